@@ -1,6 +1,8 @@
 from flask import Flask
 from flask_pymongo import PyMongo
 from flask_cors import CORS
+from utils.cache import cache
+from utils.json_response import OrjsonProvider
 import logging
 from datetime import timezone, timedelta
 
@@ -19,6 +21,49 @@ logging.getLogger('meal_insulin').setLevel(logging.DEBUG)
 # Initialize MongoDB
 mongo = PyMongo()
 
+# Indexes backing the hot query paths: collection -> [(keys, options), ...]
+INDEXES = {
+    'users': [
+        # Doctor patient list: equality on user_type (the documents are still
+        # fetched, since the list also reads _id and the active fields)
+        ([('user_type', 1)], {}),
+    ],
+    # Data export: per-user range scans returned newest first.
+    # medication_logs also serves the insulin data and analytics queries.
+    'blood_sugar': [
+        ([('user_id', 1), ('timestamp', -1)], {}),
+    ],
+    'meals': [
+        ([('user_id', 1), ('timestamp', -1)], {}),
+        # Insulin data: only meals with insulin, per patient, newest first
+        # (_id breaks ties for pagination)
+        ([('patient_id', 1), ('timestamp', -1), ('_id', -1)],
+         {'partialFilterExpression': {'intended_insulin': {'$exists': True}}}),
+    ],
+    'activities': [
+        ([('user_id', 1), ('timestamp', -1)], {}),
+    ],
+    'medication_logs': [
+        # _id breaks ties on taken_at for insulin-data pagination
+        ([('patient_id', 1), ('is_insulin', 1), ('taken_at', -1), ('_id', -1)], {}),
+        # Active insulin: doses whose effect has not ended yet
+        ([('patient_id', 1), ('is_insulin', 1), ('effect_end_time', 1)], {}),
+    ],
+    'patient_constants': [
+        ([('patient_id', 1)], {'unique': True}),
+    ],
+}
+
+
+def ensure_indexes(mongo):
+    """Create the indexes in INDEXES; existing indexes are left untouched"""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                mongo.db[collection].create_index(keys, background=True, **options)
+            except Exception as e:
+                logger.warning(f"Could not create index {keys} on {collection}: {str(e)}")
+
 def create_app_config(app):
     # Update CORS configuration
     CORS(app, resources={
@@ -38,11 +83,18 @@ def create_app_config(app):
         SECRET_KEY='your_secret_key',
         APP_TIMEZONE=timezone.utc,
         TOKEN_EXPIRY=timedelta(hours=24),
-        ALLOWED_ORIGINS=["http://localhost:3000"]
+        ALLOWED_ORIGINS=["http://localhost:3000"],
+        REDIS_URL=None  # e.g. "redis://localhost:6379/0"; None caches in-process
     )
 
+    # Encode jsonify responses with orjson when it is available
+    if OrjsonProvider is not None:
+        app.json = OrjsonProvider(app)
+
     # Initialize MongoDB with app
     mongo.init_app(app)
+    ensure_indexes(mongo)
+    cache.init_app(app)
 
     # Make these accessible throughout the app
     app.mongo = mongo
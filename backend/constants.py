@@ -490,9 +490,14 @@ class Constants:
                 if hasattr(self.default_config, k)
             }
 
+            if not valid_constants:
+                return False
+
+            from config import mongo
+            # Dotted paths only rewrite the constants that changed, not the whole subdocument
             result = mongo.db.users.update_one(
                 {'_id': ObjectId(self.patient_id)},
-                {'$set': {'patient_constants': valid_constants}}
+                {'$set': {f'patient_constants.{k}': v for k, v in valid_constants.items()}}
             )
 
             if result.modified_count > 0:
@@ -691,6 +691,9 @@ def submit_meal(current_user):
                     'is_insulin': True,
                     'meal_id': meal_id,
                     'meal_type': data['mealType'],
+                    # Copied from the meal so insulin analytics need no join
+                    'meal_timestamp': current_time,
+                    'meal_blood_sugar': data.get('bloodSugar'),
                     'blood_sugar': data.get('bloodSugar'),
                     'blood_sugar_timestamp': blood_sugar_timestamp,
                     'blood_sugar_id': blood_sugar_id,
@@ -726,7 +729,8 @@ def submit_meal(current_user):
                         {
                             '$addToSet': {
                                 'active_medications': data['intendedInsulinType']
-                            }
+                            },
+                            '$inc': {'constants_version': 1}
                         }
                     )
                     logger.info(f"Added {data['intendedInsulinType']} to user's active medications")
@@ -1,12 +1,16 @@
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import datetime, timezone
 from bson.objectid import ObjectId
 from utils.auth import token_required
 
 auth_routes = Blueprint('auth_routes', __name__)
 
+# Token lifetime in seconds; PyJWT accepts an integer epoch for the 'exp' claim
+TOKEN_LIFETIME_SECONDS = 24 * 60 * 60
+
 
 
 @auth_routes.route('/login', methods=['POST'])
@@ -42,7 +46,7 @@ def login():
             token = jwt.encode({
                 'user_id': str(user['_id']),
                 'user_type': user['user_type'],
-                'exp': datetime.now(timezone.utc) + timedelta(hours=24)
+                'exp': int(time.time()) + TOKEN_LIFETIME_SECONDS
             }, current_app.config['SECRET_KEY'], algorithm="HS256")
 
             # Prepare response
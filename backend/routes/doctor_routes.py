@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from bson.objectid import ObjectId
-from utils.auth import token_required
+from pymongo import ReturnDocument, WriteConcern
+from utils.auth import token_required, doctor_required
 from utils.error_handler import api_error_handler
+from utils.cache import cache, patient_constants_cache_key
+from utils.json_response import json_response
 from config import mongo
 from constants import Constants, ConstantConfig
 import logging
@@ -10,127 +13,187 @@ from datetime import datetime  # Add this import for medication logging
 logger = logging.getLogger(__name__)
 doctor_routes = Blueprint('doctor_routes', __name__)
 
+# Constant fields that fall back to the defaults when a patient has no override
+_CONSTANT_KEYS = (
+    'insulin_to_carb_ratio',
+    'correction_factor',
+    'target_glucose',
+    'protein_factor',
+    'fat_factor',
+    'carb_to_bg_factor',
+    'activity_coefficients',
+    'absorption_modifiers',
+    'insulin_timing_guidelines',
+    'disease_factors'
+)
+
+# Default values for _CONSTANT_KEYS, resolved once at import
+_DEFAULT_CONSTANT_VALUES = {key: Constants.DEFAULT_PATIENT_CONSTANTS[key] for key in _CONSTANT_KEYS}
+
+# Every constant field a doctor can read or update on a patient
+_PATIENT_CONSTANT_FIELDS = _CONSTANT_KEYS + (
+    'medication_factors',
+    'active_conditions',
+    'active_medications'
+)
+
+_PATIENT_CONSTANT_FIELD_SET = frozenset(_PATIENT_CONSTANT_FIELDS)
+
+# List fields stored de-duplicated, in the order the doctor entered them
+_ACTIVE_FIELDS = ('active_conditions', 'active_medications')
+
+# _id stays in the projection so a patient without any constants is still found.
+# constants_version is bumped on every write and used as the weak ETag.
+_PATIENT_CONSTANTS_PROJECTION = {field: 1 for field in _PATIENT_CONSTANT_FIELDS} | {'constants_version': 1}
+
+# Update applied alongside every write to the patient's constants
+_BUMP_CONSTANTS_VERSION = {'constants_version': 1}
+
+# Values written by a constants reset, built once from the ConstantConfig defaults.
+# Shared across requests, so it must never be mutated.
+_default_config = ConstantConfig()
+_RESET_CONSTANTS = {
+    'insulin_to_carb_ratio': _default_config.insulin_to_carb_ratio,
+    'correction_factor': _default_config.correction_factor,
+    'target_glucose': _default_config.target_glucose,
+    'protein_factor': _default_config.protein_factor,
+    'fat_factor': _default_config.fat_factor,
+    'carb_to_bg_factor': _default_config.carb_to_bg_factor,
+    'activity_coefficients': _default_config.activity_coefficients,
+    'absorption_modifiers': _default_config.absorption_modifiers,
+    'insulin_timing_guidelines': _default_config.insulin_timing_guidelines,
+    'disease_factors': _default_config.disease_factors,
+    'medication_factors': _default_config.medication_factors,
+    # Reset active conditions and medications to empty lists
+    'active_conditions': [],
+    'active_medications': []
+}
+
+# Documents per cursor batch when listing patients, bounds memory per getMore
+_PATIENT_LIST_BATCH_SIZE = 500
+
+# Seconds a serialized get_patient_constants response stays cached
+_CONSTANTS_CACHE_TTL = 300
+
+
+def _constants_response(body, version):
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(version, weak=True)
+    return response
+
+
+def _not_modified(version):
+    response = current_app.response_class(status=304)
+    response.set_etag(version, weak=True)
+    return response
+
+# Interactive writes (medication logs, constants updates) are acknowledged by the
+# primary without waiting for a journal sync; the doctor can simply retry
+_UNJOURNALED_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
 @doctor_routes.route('/api/doctor/patients', methods=['GET'])
 @token_required
+@doctor_required
 @api_error_handler
 def get_doctor_patients(current_user):
     logger.debug(f"Attempting to fetch patients for doctor: {current_user.get('_id')}")
 
-    if current_user.get('user_type') != 'doctor':
-        logger.warning(f"Unauthorized access attempt by user: {current_user.get('_id')}")
-        return jsonify({'message': 'Unauthorized access'}), 403
-
-    patients = list(mongo.db.users.find(
-        {"user_type": "patient"},
-        {"password": 0}
-    ))
-
-    patient_list = []
-    for patient in patients:
-        try:
-            patient_data = {
-                'id': str(patient['_id']),
-                'firstName': patient.get('first_name', ''),
-                'lastName': patient.get('last_name', ''),
-                'email': patient.get('email', ''),
-                # Add active diseases and medications to patient list view
-                'activeConditions': patient.get('active_conditions', []),
-                'activeMedications': patient.get('active_medications', [])
-            }
-            patient_list.append(patient_data)
-        except Exception as e:
-            logger.error(f"Error processing patient data: {str(e)}")
-            continue
+    # Shape the patient list server-side so no per-patient Python loop is needed
+    pipeline = [
+        {'$match': {'user_type': 'patient'}},
+        {'$project': {
+            '_id': 0,
+            'id': {'$toString': '$_id'},
+            'firstName': {'$ifNull': ['$first_name', '']},
+            'lastName': {'$ifNull': ['$last_name', '']},
+            'email': {'$ifNull': ['$email', '']},
+            # Add active diseases and medications to patient list view
+            'activeConditions': {'$ifNull': ['$active_conditions', []]},
+            'activeMedications': {'$ifNull': ['$active_medications', []]}
+        }}
+    ]
+    patient_list = list(mongo.db.users.aggregate(pipeline, batchSize=_PATIENT_LIST_BATCH_SIZE))
 
     return jsonify(patient_list), 200
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/constants', methods=['GET'])
 @token_required
+@doctor_required
 @api_error_handler
 def get_patient_constants(current_user, patient_id):
-    if current_user.get('user_type') != 'doctor':
-        return jsonify({'message': 'Unauthorized access'}), 403
+    if not ObjectId.is_valid(patient_id):
+        return jsonify({'message': 'Invalid patient id'}), 400
+    pid = ObjectId(patient_id)
 
     try:
-        patient = mongo.db.users.find_one({"_id": ObjectId(patient_id)})
+        # The version alone answers a conditional request and picks the cache entry
+        patient = mongo.db.users.find_one({"_id": pid}, {'constants_version': 1})
         if not patient:
             return jsonify({'message': 'Patient not found'}), 404
+        version = str(patient.get('constants_version', 0))
+        if request.if_none_match.contains_weak(version):
+            return _not_modified(version)
 
-        # Get default constants
-        default_constants = Constants.DEFAULT_PATIENT_CONSTANTS
+        cached = cache.get(patient_constants_cache_key(pid, version))
+        if cached is not None:
+            return _constants_response(cached, version), 200
+
+        patient = mongo.db.users.find_one(
+            {"_id": pid},
+            _PATIENT_CONSTANTS_PROJECTION
+        )
+        if not patient:
+            return jsonify({'message': 'Patient not found'}), 404
+        version = str(patient.get('constants_version', 0))
 
         # Get medication factors ensuring both defaults and patient overrides
         medication_factors = {
-            **default_constants['medication_factors'],  # Start with defaults
+            **Constants.DEFAULT_PATIENT_CONSTANTS['medication_factors'],  # Start with defaults
             **(patient.get('medication_factors', {}))  # Override with patient specifics
         }
 
-        # Return the full set of constants
-        constants = {
-            'insulin_to_carb_ratio': patient.get('insulin_to_carb_ratio', default_constants['insulin_to_carb_ratio']),
-            'correction_factor': patient.get('correction_factor', default_constants['correction_factor']),
-            'target_glucose': patient.get('target_glucose', default_constants['target_glucose']),
-            'protein_factor': patient.get('protein_factor', default_constants['protein_factor']),
-            'fat_factor': patient.get('fat_factor', default_constants['fat_factor']),
-            'carb_to_bg_factor': patient.get('carb_to_bg_factor', default_constants['carb_to_bg_factor']),  # Add this line to return carb_to_bg_factor
-            'activity_coefficients': patient.get('activity_coefficients', default_constants['activity_coefficients']),
-            'absorption_modifiers': patient.get('absorption_modifiers', default_constants['absorption_modifiers']),
-            'insulin_timing_guidelines': patient.get('insulin_timing_guidelines', default_constants['insulin_timing_guidelines']),
-            'disease_factors': patient.get('disease_factors', default_constants['disease_factors']),
-            'medication_factors': medication_factors,  # Use the merged medication factors
-            'active_conditions': patient.get('active_conditions', []),
-            'active_medications': patient.get('active_medications', [])
-        }
+        # Return the full set of constants: defaults overlaid with patient values
+        constants = _DEFAULT_CONSTANT_VALUES | {key: patient[key] for key in _CONSTANT_KEYS if key in patient}
+        constants['medication_factors'] = medication_factors  # Use the merged medication factors
+        constants['active_conditions'] = patient.get('active_conditions', [])
+        constants['active_medications'] = patient.get('active_medications', [])
 
         # Add debug logging
         logger.debug(f"Sending medication factors: {medication_factors}")
         logger.debug(f"Full constants being sent: {constants}")
 
-        return jsonify({'constants': constants}), 200
+        response = json_response({'constants': constants})
+        response.set_etag(version, weak=True)
+        cache.set(patient_constants_cache_key(pid, version), response.get_data(), expire=_CONSTANTS_CACHE_TTL)
+        return response, 200
     except Exception as e:
         logger.error(f"Error fetching patient constants: {str(e)}")
         return jsonify({'message': 'Error fetching patient constants'}), 500
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/constants/reset', methods=['POST'])
 @token_required
+@doctor_required
 @api_error_handler
 def reset_patient_constants(current_user, patient_id):
-    if current_user.get('user_type') != 'doctor':
-        return jsonify({'message': 'Unauthorized access'}), 403
+    if not ObjectId.is_valid(patient_id):
+        return jsonify({'message': 'Invalid patient id'}), 400
+    pid = ObjectId(patient_id)
 
     try:
-        # Get default constants from ConstantConfig
-        default_config = ConstantConfig()
-        default_constants = {
-            'insulin_to_carb_ratio': default_config.insulin_to_carb_ratio,
-            'correction_factor': default_config.correction_factor,
-            'target_glucose': default_config.target_glucose,
-            'protein_factor': default_config.protein_factor,
-            'fat_factor': default_config.fat_factor,
-            'carb_to_bg_factor': default_config.carb_to_bg_factor,  # Add this line for reset function
-            'activity_coefficients': default_config.activity_coefficients,
-            'absorption_modifiers': default_config.absorption_modifiers,
-            'insulin_timing_guidelines': default_config.insulin_timing_guidelines,
-            # Add new disease and medication factors
-            'disease_factors': default_config.disease_factors,
-            'medication_factors': default_config.medication_factors,
-            # Reset active conditions and medications to empty lists
-            'active_conditions': [],
-            'active_medications': []
-        }
-
         # Update patient with default constants
-        result = mongo.db.users.update_one(
-            {"_id": ObjectId(patient_id)},
-            {"$set": default_constants}
+        result = mongo.db.users.with_options(
+            write_concern=_UNJOURNALED_WRITE_CONCERN
+        ).update_one(
+            {"_id": pid},
+            {"$set": _RESET_CONSTANTS, "$inc": _BUMP_CONSTANTS_VERSION}
         )
 
         if result.matched_count == 0:
             return jsonify({'message': 'Patient not found'}), 404
 
-        return jsonify({
+        return json_response({
             'message': 'Constants reset to defaults successfully',
-            'constants': default_constants
+            'constants': _RESET_CONSTANTS
         }), 200
     except Exception as e:
         logger.error(f"Error resetting patient constants: {str(e)}")
@@ -138,10 +201,12 @@ def reset_patient_constants(current_user, patient_id):
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/constants', methods=['PUT'])
 @token_required
+@doctor_required
 @api_error_handler
 def update_patient_constants(current_user, patient_id):
-    if current_user.get('user_type') != 'doctor':
-        return jsonify({'message': 'Unauthorized access'}), 403
+    if not ObjectId.is_valid(patient_id):
+        return jsonify({'message': 'Invalid patient id'}), 400
+    pid = ObjectId(patient_id)
 
     try:
         data = request.json
@@ -150,31 +215,21 @@ def update_patient_constants(current_user, patient_id):
         if not constants:
             return jsonify({'message': 'Missing required constants data'}), 400
 
-        # Updated required fields to include new factors
-        required_fields = [
-            'insulin_to_carb_ratio',
-            'correction_factor',
-            'target_glucose',
-            'protein_factor',
-            'fat_factor',
-            'carb_to_bg_factor',  # Add this line to include carb_to_bg_factor
-            'activity_coefficients',
-            'absorption_modifiers',
-            'insulin_timing_guidelines',
-            'disease_factors',
-            'medication_factors',
-            'active_conditions',
-            'active_medications'
-        ]
-
-        update_data = {}
-        for field in required_fields:
-            if field in constants:
-                update_data[field] = constants[field]
+        update_data = {
+            field: value for field, value in constants.items()
+            if field in _PATIENT_CONSTANT_FIELD_SET
+        }
 
         if not update_data:
             return jsonify({'message': 'No valid constants provided'}), 400
 
+        for field in _ACTIVE_FIELDS:
+            if field in update_data:
+                values = update_data[field]
+                if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                    return jsonify({'message': f'{field} must be a list of strings'}), 400
+                update_data[field] = list(dict.fromkeys(values))
+
         # Validate disease factors
         if 'disease_factors' in update_data:
             default_diseases = Constants.DEFAULT_PATIENT_CONSTANTS['disease_factors']
@@ -195,21 +250,24 @@ def update_patient_constants(current_user, patient_id):
                         'valid_medications': list(default_medications.keys())
                     }), 400
 
-        result = mongo.db.users.update_one(
-            {"_id": ObjectId(patient_id)},
-            {"$set": update_data}
+        # Update and read back the constants in a single round trip
+        updated_user = mongo.db.users.with_options(
+            write_concern=_UNJOURNALED_WRITE_CONCERN
+        ).find_one_and_update(
+            {"_id": pid},
+            {"$set": update_data, "$inc": _BUMP_CONSTANTS_VERSION},
+            projection=_PATIENT_CONSTANTS_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.matched_count == 0:
+        if updated_user is None:
             return jsonify({'message': 'Patient not found'}), 404
 
-        # Return the updated constants
-        updated_user = mongo.db.users.find_one({"_id": ObjectId(patient_id)})
         updated_constants = {
-            field: updated_user.get(field) for field in required_fields
+            field: updated_user.get(field) for field in _PATIENT_CONSTANT_FIELDS
         }
 
-        return jsonify({
+        return json_response({
             'message': 'Constants updated successfully',
             'constants': updated_constants
         }), 200
@@ -219,14 +277,16 @@ def update_patient_constants(current_user, patient_id):
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/conditions', methods=['PUT'])
 @token_required
+@doctor_required
 @api_error_handler
 def update_patient_conditions(current_user, patient_id):
-        if current_user.get('user_type') != 'doctor':
-            return jsonify({'message': 'Unauthorized access'}), 403
+        if not ObjectId.is_valid(patient_id):
+            return jsonify({'message': 'Invalid patient id'}), 400
+        pid = ObjectId(patient_id)
 
         try:
             data = request.json
-            conditions = data.get('conditions', [])
+            conditions = list(dict.fromkeys(data.get('conditions', [])))
 
             # Validate conditions against available disease factors
             valid_conditions = Constants.DEFAULT_PATIENT_CONSTANTS['disease_factors'].keys()
@@ -240,8 +300,8 @@ def update_patient_conditions(current_user, patient_id):
 
             # Update patient's active conditions
             result = mongo.db.users.update_one(
-                {"_id": ObjectId(patient_id)},
-                {"$set": {"active_conditions": conditions}}
+                {"_id": pid},
+                {"$set": {"active_conditions": conditions}, "$inc": _BUMP_CONSTANTS_VERSION}
             )
 
             if result.matched_count == 0:
@@ -257,14 +317,16 @@ def update_patient_conditions(current_user, patient_id):
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/medications', methods=['PUT'])
 @token_required
+@doctor_required
 @api_error_handler
 def update_patient_medications(current_user, patient_id):
-        if current_user.get('user_type') != 'doctor':
-            return jsonify({'message': 'Unauthorized access'}), 403
+        if not ObjectId.is_valid(patient_id):
+            return jsonify({'message': 'Invalid patient id'}), 400
+        pid = ObjectId(patient_id)
 
         try:
             data = request.json
-            medications = data.get('medications', [])
+            medications = list(dict.fromkeys(data.get('medications', [])))
 
             # Validate medications against available medication factors
             valid_medications = Constants.DEFAULT_PATIENT_CONSTANTS['medication_factors'].keys()
@@ -278,8 +340,8 @@ def update_patient_medications(current_user, patient_id):
 
             # Update patient's active medications
             result = mongo.db.users.update_one(
-                {"_id": ObjectId(patient_id)},
-                {"$set": {"active_medications": medications}}
+                {"_id": pid},
+                {"$set": {"active_medications": medications}, "$inc": _BUMP_CONSTANTS_VERSION}
             )
 
             if result.matched_count == 0:
@@ -295,11 +357,9 @@ def update_patient_medications(current_user, patient_id):
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/medication-log', methods=['POST'])
 @token_required
+@doctor_required
 @api_error_handler
 def log_medication(current_user, patient_id):
-            if current_user.get('user_type') != 'doctor':
-                return jsonify({'message': 'Unauthorized access'}), 403
-
             try:
                 data = request.json
                 medication_log = {
@@ -311,7 +371,9 @@ def log_medication(current_user, patient_id):
                     'created_at': datetime.utcnow()
                 }
 
-                result = mongo.db.medication_logs.insert_one(medication_log)
+                result = mongo.db.medication_logs.with_options(
+                    write_concern=_UNJOURNALED_WRITE_CONCERN
+                ).insert_one(medication_log)
 
                 return jsonify({
                     'message': 'Medication log created successfully',
@@ -323,11 +385,9 @@ def log_medication(current_user, patient_id):
 
 @doctor_routes.route('/api/doctor/patient/<patient_id>/medication-log', methods=['GET'])
 @token_required
+@doctor_required
 @api_error_handler
 def get_medication_logs(current_user, patient_id):
-            if current_user.get('user_type') != 'doctor':
-                return jsonify({'message': 'Unauthorized access'}), 403
-
             try:
                 logs = list(mongo.db.medication_logs.find(
                     {'patient_id': patient_id}
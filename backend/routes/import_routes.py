@@ -1,15 +1,36 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from werkzeug.utils import secure_filename
 import os
 import json
 import csv
+import functools
+import hashlib
 import io
+import itertools
+import sys
+import tempfile
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
 import logging
 from config import mongo
 from utils.auth import token_required
 from utils.error_handler import api_error_handler
+from utils.cache import TTLCache
+from utils.json_response import dumps, json_response
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib decoder
+    orjson = None
+
+    def _loads(data):
+        return json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -18,10 +39,52 @@ import_routes = Blueprint('import_routes', __name__)
 # Define allowed file extensions
 ALLOWED_EXTENSIONS = {'csv', 'json'}
 
+# Background imports, requested with the form field async=true. Jobs run and are
+# tracked in this process, so status must be polled from the same worker.
+_import_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='import')
+_import_jobs = {}
+_import_jobs_lock = threading.Lock()
+MAX_IMPORT_JOBS = 256
+# Queued jobs hold their parsed records in memory, so cap the unfinished ones
+MAX_PENDING_IMPORT_JOBS = 16
+
+# Runs the per-type imports of one 'all' import side by side
+_import_type_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='import-type')
+
+# Marks a missing key where falsy values such as 0 are legitimate
+_MISSING = object()
+
+# datetime.fromisoformat understands a trailing 'Z' from Python 3.11 on
+_ISO_HANDLES_Z = sys.version_info >= (3, 11)
+
+
+def file_extension(filename):
+    """Lowercased extension of filename, or '' if it has none"""
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return file_extension(filename) in ALLOWED_EXTENSIONS
+
+
+def _parse_iso_z(value):
+    """
+    Fast path for the 'YYYY-MM-DDTHH:MM:SSZ' form used by the app's own exports
+    and templates. Returns None for anything else.
+    """
+    if (len(value) == 20 and value[19] == 'Z' and value[10] == 'T' and value[4] == '-'
+            and value[7] == '-' and value[13] == ':' and value[16] == ':'):
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]), tzinfo=timezone.utc)
+    return None
+
+
+def _fromisoformat(value):
+    """datetime.fromisoformat that also accepts a trailing 'Z' before Python 3.11"""
+    if not _ISO_HANDLES_Z and value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
 
 
 @import_routes.route('/api/import/validate', methods=['POST'])
@@ -38,19 +101,26 @@ def validate_import_data(current_user):
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        if not allowed_file(file.filename):
+        file_ext = file_extension(file.filename)
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify({'error': f'File type not allowed. Please use {", ".join(ALLOWED_EXTENSIONS)}'}), 400
 
         import_type = request.form.get('type', 'all')
         if import_type not in ['all', 'meals', 'blood_sugar', 'activities', 'insulin']:
             return jsonify({'error': 'Invalid import type specified'}), 400
 
-        # Read and validate file content
-        validation_result = validate_file_content(file, import_type)
+        # Read the file once, then validate and count the records in a single pass
+        counts = _new_counts()
+        try:
+            records = _load_records(file, file_ext, stream=True)
+        except (ValueError, csv.Error) as e:
+            validation_result = {'valid': False, 'errors': [f"File parsing error: {str(e)}"], 'warnings': []}
+            validation_result.update(counts)
+            return jsonify(validation_result)
+
+        validation_result = _validate_records(records, file_ext, import_type, counts)
 
         # Add total counts to help the user understand the data
-        file.seek(0)  # Reset file pointer to beginning
-        counts = count_records(file, import_type)
         validation_result.update(counts)
 
         return jsonify(validation_result)
@@ -74,23 +144,44 @@ def import_data(current_user):
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        if not allowed_file(file.filename):
+        file_ext = file_extension(file.filename)
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify({'error': f'File type not allowed. Please use {", ".join(ALLOWED_EXTENSIONS)}'}), 400
 
         filename = secure_filename(file.filename)
         import_type = request.form.get('type', 'all')
 
-        # Validate first
-        validation_result = validate_file_content(file, import_type)
+        # Parse once, then validate and import the same records
+        try:
+            records = _load_records(file, file_ext)
+        except (ValueError, csv.Error) as e:
+            return jsonify({
+                'error': 'Validation failed',
+                'details': {'valid': False, 'errors': [f"File parsing error: {str(e)}"], 'warnings': []}
+            }), 400
+
+        validation_result = _validate_records(records, file_ext, import_type)
         if validation_result.get('errors', []):
             return jsonify({
                 'error': 'Validation failed',
                 'details': validation_result
             }), 400
 
+        # Large imports can be handed to a background worker instead of holding the request
+        if request.form.get('async', '').lower() == 'true':
+            job_id = _submit_import_job(records, import_type, current_user['_id'])
+            if job_id is None:
+                return jsonify({'error': 'Too many imports in progress, please try again later'}), 503, {
+                    'Retry-After': '30'
+                }
+            return jsonify({
+                'success': True,
+                'message': 'Import queued',
+                'job_id': job_id
+            }), 202
+
         # Process and import data
-        file.seek(0)  # Reset file pointer to beginning
-        import_result = process_import(file, import_type, current_user['_id'])
+        import_result = _process_records(records, import_type, current_user['_id'])
 
         return jsonify({
             'success': True,
@@ -103,11 +194,94 @@ def import_data(current_user):
         return jsonify({'error': f'Import error: {str(e)}'}), 500
 
 
-def validate_file_content(file, import_type):
+@import_routes.route('/api/import/status/<job_id>', methods=['GET'])
+@token_required
+def get_import_status(current_user, job_id):
+    """
+    Report the state of a background import started by the current user
+    """
+    with _import_jobs_lock:
+        job = _import_jobs.get(job_id)
+        job = dict(job) if job else None
+
+    if not job or job['user_id'] != str(current_user['_id']):
+        return jsonify({'error': 'Import job not found'}), 404
+
+    del job['user_id']
+    return jsonify(job), 200
+
+
+def _submit_import_job(records, import_type, user_id):
+    """
+    Queue records for import on the background executor and return the job id,
+    or None when MAX_PENDING_IMPORT_JOBS jobs are already queued or running
+    """
+    job_id = uuid.uuid4().hex
+    with _import_jobs_lock:
+        pending = sum(1 for j in _import_jobs.values() if j['state'] in ('queued', 'running'))
+        if pending >= MAX_PENDING_IMPORT_JOBS:
+            return None
+
+        # Forget the oldest completed jobs once the table is full; the pending
+        # cap leaves enough of them to make room
+        if len(_import_jobs) >= MAX_IMPORT_JOBS:
+            done = [k for k, j in _import_jobs.items() if j['state'] in ('finished', 'failed')]
+            for old_id in done[:len(_import_jobs) - MAX_IMPORT_JOBS + 1]:
+                del _import_jobs[old_id]
+        _import_jobs[job_id] = {'user_id': str(user_id), 'state': 'queued'}
+
+    _import_executor.submit(_run_import_job, job_id, records, import_type, user_id)
+    return job_id
+
+
+def _run_import_job(job_id, records, import_type, user_id):
+    """
+    Executor task: import the records and store the outcome on the job
+    """
+    with _import_jobs_lock:
+        _import_jobs[job_id]['state'] = 'running'
+
+    try:
+        results = _process_records(records, import_type, user_id)
+        update = {'state': 'finished', 'results': results}
+    except Exception as e:
+        logger.error(f"Error in background import {job_id}: {str(e)}")
+        update = {'state': 'failed', 'error': str(e)}
+
+    with _import_jobs_lock:
+        _import_jobs[job_id].update(update)
+
+
+def _load_records(file, file_ext, stream=False):
+    """
+    Read and parse the uploaded file once, returning its records.
+    With stream=True CSV rows are returned as a lazy reader instead of a list.
+    """
+    file.seek(0)
+
+    if file_ext == 'csv':
+        # Decode incrementally from the upload stream instead of copying it into one str
+        text = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+        reader = csv.DictReader(text)
+        if stream:
+            return reader
+        records = list(reader)
+        text.detach()  # Leave the upload stream open for werkzeug to clean up
+        return records
+
+    data = _loads(file.read())
+    if not isinstance(data, list):
+        if isinstance(data, dict) and isinstance(data.get('data'), list):
+            data = data['data']
+        else:
+            raise ValueError("JSON file should contain an array of records")
+    return data
+
+
+def _validate_records(records, file_ext, import_type, counts=None):
     """
-    Validate the content of the uploaded file using built-in CSV and JSON modules
+    Validate records parsed by _load_records, tallying them into counts when given
     """
-    file_ext = file.filename.rsplit('.', 1)[1].lower()
     validation_results = {
         'valid': True,
         'errors': [],
@@ -115,44 +289,26 @@ def validate_file_content(file, import_type):
     }
 
     try:
-        # Parse the file based on its type
+        # Check the records based on the file type
         if file_ext == 'csv':
-            file.seek(0)
-            # Read CSV data
-            csv_content = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(csv_content))
-
-            # Convert to list to count records and check headers
-            records = list(reader)
-
-            if not records:
+            rows = iter(records)
+            first_row = next(rows, None)
+            if first_row is None:
                 validation_results['errors'].append("File appears to be empty or has no valid data rows")
                 validation_results['valid'] = False
                 return validation_results
 
-            # Check headers based on import type
-            headers = reader.fieldnames
+            # Check headers based on import type (every DictReader row carries all columns)
+            headers = frozenset(first_row)
+            check_blood_sugar = import_type == 'blood_sugar' or import_type == 'all'
+            bs_key = 'bloodSugar' if 'bloodSugar' in headers else 'blood_sugar'
 
-            if import_type == 'blood_sugar' or import_type == 'all':
+            if check_blood_sugar:
                 if 'bloodSugar' not in headers and 'blood_sugar' not in headers:
                     validation_results['errors'].append("Blood sugar data is missing required column 'bloodSugar'")
                 if 'timestamp' not in headers and 'bloodSugarTimestamp' not in headers:
                     validation_results['errors'].append("Blood sugar data is missing timestamp column")
 
-                # Validate blood sugar values
-                for i, row in enumerate(records):
-                    blood_sugar = row.get('bloodSugar', row.get('blood_sugar'))
-                    if blood_sugar:
-                        try:
-                            bs_value = float(blood_sugar)
-                            if bs_value < 0:
-                                validation_results['warnings'].append(f"Row {i + 2}: Blood sugar cannot be negative")
-                            elif bs_value > 600:
-                                validation_results['warnings'].append(f"Row {i + 2}: Blood sugar value seems very high")
-                        except ValueError:
-                            validation_results['errors'].append(
-                                f"Row {i + 2}: Blood sugar value '{blood_sugar}' is not a number")
-
             if import_type == 'meals' or import_type == 'all':
                 if 'timestamp' not in headers:
                     validation_results['errors'].append("Meal data is missing required 'timestamp' column")
@@ -173,71 +329,38 @@ def validate_file_content(file, import_type):
                 if 'medication' not in headers and 'insulinType' not in headers and 'insulin_type' not in headers:
                     validation_results['errors'].append("Insulin data is missing required insulin type column")
 
-        elif file_ext == 'json':
-            # Parse JSON data
-            file.seek(0)  # Reset file pointer
-            content = file.read().decode('utf-8')
-            data = json.loads(content)
-
-            # Check if the data is an array
-            if not isinstance(data, list):
-                if 'data' in data and isinstance(data['data'], list):
-                    data = data['data']
-                else:
-                    validation_results['errors'].append("JSON file should contain an array of records")
-                    validation_results['valid'] = False
-                    return validation_results
+            # Validate blood sugar values and count rows in a single pass
+            for i, row in enumerate(itertools.chain((first_row,), rows)):
+                if counts is not None:
+                    _count_record(row, counts)
 
-            if not data:
+                if check_blood_sugar:
+                    blood_sugar = row.get(bs_key)
+                    if blood_sugar:
+                        try:
+                            bs_value = float(blood_sugar)
+                            if bs_value < 0:
+                                validation_results['warnings'].append(f"Row {i + 2}: Blood sugar cannot be negative")
+                            elif bs_value > 600:
+                                validation_results['warnings'].append(f"Row {i + 2}: Blood sugar value seems very high")
+                        except ValueError:
+                            validation_results['errors'].append(
+                                f"Row {i + 2}: Blood sugar value '{blood_sugar}' is not a number")
+
+        elif file_ext == 'json':
+            if not records:
                 validation_results['errors'].append("JSON file contains no records")
                 validation_results['valid'] = False
                 return validation_results
 
-            # Validate each record based on type
-            for i, record in enumerate(data):
-                if import_type == 'blood_sugar' or import_type == 'all':
-                    if 'bloodSugar' not in record and 'blood_sugar' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Blood sugar value missing")
-                    else:
-                        # Validate blood sugar value
-                        blood_sugar = record.get('bloodSugar', record.get('blood_sugar'))
-                        if not isinstance(blood_sugar, (int, float)):
-                            validation_results['errors'].append(f"Record #{i + 1}: Blood sugar value must be a number")
-                        elif blood_sugar < 0:
-                            validation_results['warnings'].append(f"Record #{i + 1}: Blood sugar cannot be negative")
-                        elif blood_sugar > 600:
-                            validation_results['warnings'].append(f"Record #{i + 1}: Blood sugar value seems very high")
-
-                    if 'timestamp' not in record and 'bloodSugarTimestamp' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Timestamp missing")
-
-                if import_type == 'meals' or import_type == 'all':
-                    if 'timestamp' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Timestamp missing for meal")
-                    if 'mealType' not in record and 'meal_type' not in record:
-                        validation_results['warnings'].append(
-                            f"Record #{i + 1}: Meal type missing - will default to 'normal'")
-
-                if import_type == 'activities' or import_type == 'all':
-                    if 'level' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Activity level missing")
-                    if 'duration' not in record and ('startTime' not in record or 'endTime' not in record):
-                        validation_results['errors'].append(
-                            f"Record #{i + 1}: Activity needs either duration or start/end times")
-
-                if import_type == 'insulin' or import_type == 'all':
-                    if 'dose' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Insulin dose missing")
-                    else:
-                        # Validate dose
-                        dose = record.get('dose')
-                        if not isinstance(dose, (int, float)):
-                            validation_results['errors'].append(f"Record #{i + 1}: Insulin dose must be a number")
-                        elif dose < 0:
-                            validation_results['warnings'].append(f"Record #{i + 1}: Insulin dose cannot be negative")
+            # Validate each record with the validators selected for the import type
+            validators = _RECORD_VALIDATORS.get(import_type, ())
+            for i, record in enumerate(records):
+                if counts is not None:
+                    _count_record(record, counts)
 
-                    if 'medication' not in record and 'insulinType' not in record and 'insulin_type' not in record:
-                        validation_results['errors'].append(f"Record #{i + 1}: Insulin type missing")
+                for validate in validators:
+                    validate(i, record, validation_results)
 
         # Check if there are any validation errors
         if validation_results['errors']:
@@ -251,12 +374,86 @@ def validate_file_content(file, import_type):
         return validation_results
 
 
-def count_records(file, import_type):
+def _validate_blood_sugar_record(i, record, validation_results):
+    """Check a JSON record's blood sugar value and timestamp"""
+    if 'bloodSugar' not in record and 'blood_sugar' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Blood sugar value missing")
+    else:
+        # Validate blood sugar value
+        blood_sugar = record.get('bloodSugar', _MISSING)
+        if blood_sugar is _MISSING:
+            blood_sugar = record.get('blood_sugar')
+        if not isinstance(blood_sugar, (int, float)):
+            validation_results['errors'].append(f"Record #{i + 1}: Blood sugar value must be a number")
+        elif blood_sugar < 0:
+            validation_results['warnings'].append(f"Record #{i + 1}: Blood sugar cannot be negative")
+        elif blood_sugar > 600:
+            validation_results['warnings'].append(f"Record #{i + 1}: Blood sugar value seems very high")
+
+    if 'timestamp' not in record and 'bloodSugarTimestamp' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Timestamp missing")
+
+
+def _validate_meal_record(i, record, validation_results):
+    """Check a JSON record's meal timestamp and type"""
+    if 'timestamp' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Timestamp missing for meal")
+    if 'mealType' not in record and 'meal_type' not in record:
+        validation_results['warnings'].append(
+            f"Record #{i + 1}: Meal type missing - will default to 'normal'")
+
+
+def _validate_activity_record(i, record, validation_results):
+    """Check a JSON record's activity level and duration"""
+    if 'level' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Activity level missing")
+    if 'duration' not in record and ('startTime' not in record or 'endTime' not in record):
+        validation_results['errors'].append(
+            f"Record #{i + 1}: Activity needs either duration or start/end times")
+
+
+def _validate_insulin_record(i, record, validation_results):
+    """Check a JSON record's insulin dose and type"""
+    if 'dose' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Insulin dose missing")
+    else:
+        # Validate dose
+        dose = record.get('dose')
+        if not isinstance(dose, (int, float)):
+            validation_results['errors'].append(f"Record #{i + 1}: Insulin dose must be a number")
+        elif dose < 0:
+            validation_results['warnings'].append(f"Record #{i + 1}: Insulin dose cannot be negative")
+
+    if 'medication' not in record and 'insulinType' not in record and 'insulin_type' not in record:
+        validation_results['errors'].append(f"Record #{i + 1}: Insulin type missing")
+
+
+# Per-record validators to run for each import type, chosen once per file
+_RECORD_VALIDATORS = {
+    'blood_sugar': (_validate_blood_sugar_record,),
+    'meals': (_validate_meal_record,),
+    'activities': (_validate_activity_record,),
+    'insulin': (_validate_insulin_record,),
+    'all': (_validate_blood_sugar_record, _validate_meal_record, _validate_activity_record,
+            _validate_insulin_record),
+}
+
+
+# Record type tags returned by _classify, and the count each one feeds
+_RECORD_TYPES = ('blood_sugar', 'meal', 'activity', 'insulin')
+_COUNT_KEYS = {
+    'blood_sugar': 'blood_sugar_records',
+    'meal': 'meal_records',
+    'activity': 'activity_records',
+    'insulin': 'insulin_records',
+}
+
+
+def _new_counts():
     """
-    Count the number of records of each type in the file
+    Zeroed per-type record counts
     """
-    file_ext = file.filename.rsplit('.', 1)[1].lower()
-    counts = {
+    return {
         'total_records': 0,
         'blood_sugar_records': 0,
         'meal_records': 0,
@@ -264,68 +461,42 @@ def count_records(file, import_type):
         'insulin_records': 0
     }
 
-    try:
-        if file_ext == 'csv':
-            file.seek(0)
-            csv_content = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(csv_content))
-            records = list(reader)
 
-            counts['total_records'] = len(records)
-
-            # Count types based on columns and values
-            for record in records:
-                if 'bloodSugar' in record or 'blood_sugar' in record:
-                    counts['blood_sugar_records'] += 1
-
-                if 'mealType' in record or 'meal_type' in record or 'foodItems' in record or 'food_items' in record:
-                    counts['meal_records'] += 1
-
-                if 'level' in record:
-                    counts['activity_records'] += 1
-
-                if 'dose' in record and ('medication' in record or 'insulinType' in record or 'insulin_type' in record):
-                    counts['insulin_records'] += 1
-
-        elif file_ext == 'json':
-            file.seek(0)
-            content = file.read().decode('utf-8')
-            data = json.loads(content)
-
-            if not isinstance(data, list):
-                if 'data' in data and isinstance(data['data'], list):
-                    data = data['data']
-                else:
-                    return counts
-
-            counts['total_records'] = len(data)
-
-            # Count types based on JSON fields
-            for record in data:
-                if 'bloodSugar' in record or 'blood_sugar' in record:
-                    counts['blood_sugar_records'] += 1
-
-                if 'mealType' in record or 'meal_type' in record or 'foodItems' in record or 'food_items' in record:
-                    counts['meal_records'] += 1
-
-                if 'level' in record:
-                    counts['activity_records'] += 1
-
-                if 'dose' in record and ('medication' in record or 'insulinType' in record or 'insulin_type' in record):
-                    counts['insulin_records'] += 1
-
-        return counts
+def _classify(record):
+    """
+    Determine which type of data a record holds, or None if it can't be told.
+    An explicit 'type' field wins, otherwise the record's fields decide.
+    """
+    record_type = record.get('type')
+    if isinstance(record_type, str) and record_type.lower() in _RECORD_TYPES:
+        return record_type.lower()
+
+    if 'bloodSugar' in record or 'blood_sugar' in record:
+        return 'blood_sugar'
+    if 'foodItems' in record or 'food_items' in record or 'mealType' in record or 'meal_type' in record:
+        return 'meal'
+    if 'level' in record:
+        return 'activity'
+    if 'dose' in record and ('medication' in record or 'insulinType' in record or 'insulin_type' in record):
+        return 'insulin'
+    return None
+
+
+def _count_record(record, counts):
+    """
+    Add one record to the total and to the count of its type
+    """
+    counts['total_records'] += 1
 
-    except Exception as e:
-        logger.error(f"Error counting records: {str(e)}")
-        return counts
+    count_key = _COUNT_KEYS.get(_classify(record))
+    if count_key:
+        counts[count_key] += 1
 
 
-def process_import(file, import_type, user_id):
+def _process_records(records, import_type, user_id):
     """
-    Process the import file and save data to the database
+    Save records parsed by _load_records to the database
     """
-    file_ext = file.filename.rsplit('.', 1)[1].lower()
     results = {
         'meals_imported': 0,
         'blood_sugar_imported': 0,
@@ -335,68 +506,34 @@ def process_import(file, import_type, user_id):
     }
 
     try:
-        # Parse the file based on its type
-        if file_ext == 'csv':
-            file.seek(0)
-            csv_content = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(csv_content))
-            records = list(reader)
-        elif file_ext == 'json':
-            file.seek(0)
-            content = file.read().decode('utf-8')
-            data = json.loads(content)
-            if not isinstance(data, list):
-                if 'data' in data and isinstance(data['data'], list):
-                    records = data['data']
-                else:
-                    results['errors'].append("Invalid JSON format: expected array of records")
-                    return results
-            else:
-                records = data
-
         # Process records based on import type
         if import_type == 'all':
             # Sort records by type and process each
-            blood_sugar_records = []
-            meal_records = []
-            activity_records = []
-            insulin_records = []
-
+            buckets = {record_type: [] for record_type in _RECORD_TYPES}
             for record in records:
-                # Try to determine record type
-                record_type = record.get('type', '').lower() if 'type' in record else ''
-
-                if record_type == 'blood_sugar' or ('bloodSugar' in record or 'blood_sugar' in record):
-                    blood_sugar_records.append(record)
-                elif record_type == 'meal' or 'foodItems' in record or 'food_items' in record:
-                    meal_records.append(record)
-                elif record_type == 'activity' or 'level' in record:
-                    activity_records.append(record)
-                elif record_type == 'insulin' or ('dose' in record and
-                                                  (
-                                                          'medication' in record or 'insulinType' in record or 'insulin_type' in record)):
-                    insulin_records.append(record)
-
-            # Import each type
-            if blood_sugar_records:
-                bs_result = import_blood_sugar(blood_sugar_records, user_id)
-                results['blood_sugar_imported'] = bs_result.get('imported', 0)
-                results['errors'].extend(bs_result.get('errors', []))
-
-            if meal_records:
-                meal_result = import_meals(meal_records, user_id)
-                results['meals_imported'] = meal_result.get('imported', 0)
-                results['errors'].extend(meal_result.get('errors', []))
-
-            if activity_records:
-                activity_result = import_activities(activity_records, user_id)
-                results['activities_imported'] = activity_result.get('imported', 0)
-                results['errors'].extend(activity_result.get('errors', []))
-
-            if insulin_records:
-                insulin_result = import_insulin(insulin_records, user_id)
-                results['insulin_imported'] = insulin_result.get('imported', 0)
-                results['errors'].extend(insulin_result.get('errors', []))
+                record_type = _classify(record)
+                if record_type:
+                    buckets[record_type].append(record)
+
+            # The types write independent documents, so run their imports concurrently
+            # to overlap the database round-trips, then merge results in a fixed order
+            futures = [
+                (record_type, result_key, _import_type_executor.submit(importer, buckets[record_type], user_id))
+                for record_type, importer, result_key in _TYPE_IMPORTERS
+                if buckets[record_type]
+            ]
+
+            # Import each type; one type failing must not drop the results of
+            # the others, which have already written their documents
+            for record_type, result_key, future in futures:
+                try:
+                    type_result = future.result()
+                except Exception as e:
+                    logger.error(f"Error importing {record_type} records: {str(e)}")
+                    results['errors'].append(f"Error importing {record_type} records: {str(e)}")
+                    continue
+                results[result_key] = type_result.get('imported', 0)
+                results['errors'].extend(type_result.get('errors', []))
 
         elif import_type == 'blood_sugar':
             bs_result = import_blood_sugar(records, user_id)
@@ -426,17 +563,52 @@ def process_import(file, import_type, user_id):
         return results
 
 
+def _insert_batch(collection, docs, record_numbers, errors):
+    """
+    Insert docs with one unordered insert_many, reporting failures by record number.
+    Returns the set of indexes into docs that were not inserted.
+    """
+    if not docs:
+        return set()
+
+    try:
+        collection.insert_many(docs, ordered=False)
+        return set()
+    except BulkWriteError as e:
+        failed = set()
+        for error in e.details.get('writeErrors', []):
+            failed.add(error['index'])
+            errors.append(f"Record #{record_numbers[error['index']]}: {error.get('errmsg', 'Insert failed')}")
+        logger.error(f"Error inserting batch into {collection.name}: {len(failed)} of {len(docs)} failed")
+        return failed
+    except PyMongoError as e:
+        # Network or server error: which documents landed is unknown, so
+        # report the whole batch as failed rather than aborting the import
+        logger.error(f"Error inserting batch into {collection.name}: {str(e)}")
+        errors.extend(f"Record #{number}: {str(e)}" for number in record_numbers)
+        return set(range(len(docs)))
+
+
 def import_blood_sugar(records, user_id):
     """
     Import blood sugar records
     """
     result = {'imported': 0, 'errors': []}
-    imported_ids = []
+    now = datetime.now(timezone.utc)  # One timestamp for the whole batch
+    bs_docs = []
+    meal_docs = []
+    record_numbers = []
+
+    # The target is the same for every reading, so look it up once
+    user_constants = get_user_constants(user_id)
+    target_glucose = user_constants.get('target_glucose', 120)
 
     for i, record in enumerate(records):
         try:
             # Normalize field names
-            blood_sugar = record.get('bloodSugar', record.get('blood_sugar'))
+            blood_sugar = record.get('bloodSugar', _MISSING)
+            if blood_sugar is _MISSING:
+                blood_sugar = record.get('blood_sugar')
             if blood_sugar is None:
                 result['errors'].append(f"Record #{i + 1}: Missing blood sugar value")
                 continue
@@ -450,15 +622,11 @@ def import_blood_sugar(records, user_id):
 
             # Normalize timestamps
             timestamp = standardize_timestamp(
-                record.get('timestamp', record.get('bloodSugarTimestamp', record.get('blood_sugar_timestamp')))
+                record.get('timestamp') or record.get('bloodSugarTimestamp') or record.get('blood_sugar_timestamp')
             )
 
             if not timestamp:
-                timestamp = datetime.now(timezone.utc)
-
-            # Create blood sugar document
-            user_constants = get_user_constants(user_id)
-            target_glucose = user_constants.get('target_glucose', 120)
+                timestamp = now
 
             # Determine status
             if blood_sugar < target_glucose * 0.7:
@@ -468,26 +636,29 @@ def import_blood_sugar(records, user_id):
             else:
                 status = "normal"
 
+            # Generate both ids up front so the documents can reference each other
+            bs_id = ObjectId()
+            meal_id = ObjectId()
+
             bs_doc = {
+                '_id': bs_id,
                 'user_id': str(user_id),
                 'bloodSugar': float(blood_sugar),
                 'status': status,
                 'target': target_glucose,
-                'timestamp': datetime.now(timezone.utc),  # When the record was created
+                'timestamp': now,  # When the record was created
                 'bloodSugarTimestamp': timestamp,  # When the reading was taken
                 'notes': record.get('notes', ''),
                 'source': 'imported',
-                'imported_at': datetime.now(timezone.utc)
+                'meal_id': str(meal_id),
+                'imported_at': now
             }
 
-            # Insert into blood_sugar collection
-            bs_result = mongo.db.blood_sugar.insert_one(bs_doc)
-            blood_sugar_id = str(bs_result.inserted_id)
-
             # Also create a meal record for blood sugar integration
             meal_doc = {
+                '_id': meal_id,
                 'user_id': str(user_id),
-                'timestamp': datetime.now(timezone.utc),
+                'timestamp': now,
                 'mealType': 'blood_sugar_only',
                 'foodItems': [],
                 'activities': [],
@@ -505,50 +676,52 @@ def import_blood_sugar(records, user_id):
                 'isStandaloneReading': True,
                 'suggestedInsulin': 0,
                 'insulinCalculation': {},
-                'blood_sugar_id': blood_sugar_id,
-                'imported_at': datetime.now(timezone.utc)
+                'blood_sugar_id': str(bs_id),
+                'imported_at': now
             }
 
-            # Insert into meals collection
-            meal_result = mongo.db.meals.insert_one(meal_doc)
-            meal_id = str(meal_result.inserted_id)
-
-            # Update the blood sugar record with the meal reference
-            mongo.db.blood_sugar.update_one(
-                {"_id": bs_result.inserted_id},
-                {"$set": {"meal_id": meal_id}}
-            )
-
-            imported_ids.append(blood_sugar_id)
-            result['imported'] += 1
+            bs_docs.append(bs_doc)
+            meal_docs.append(meal_doc)
+            record_numbers.append(i + 1)
 
         except Exception as e:
             logger.error(f"Error importing blood sugar record #{i + 1}: {str(e)}")
             result['errors'].append(f"Record #{i + 1}: {str(e)}")
 
+    # Insert readings first, then the meal records of the readings that were stored
+    failed = _insert_batch(mongo.db.blood_sugar, bs_docs, record_numbers, result['errors'])
+    if failed:
+        meal_docs = [doc for n, doc in enumerate(meal_docs) if n not in failed]
+        record_numbers = [num for n, num in enumerate(record_numbers) if n not in failed]
+    _insert_batch(mongo.db.meals, meal_docs, record_numbers, result['errors'])
+
+    result['imported'] = len(bs_docs) - len(failed)
     return result
 
 
 def import_meals(records, user_id):
     """Import meal records"""
     result = {'imported': 0, 'errors': []}
+    now = datetime.now(timezone.utc)  # One timestamp for the whole batch
+    meal_docs = []
+    meals_only_docs = []
+    record_numbers = []
 
     try:
         for i, record in enumerate(records):
             try:
                 # Process for the main meals collection
                 record['user_id'] = str(user_id)
+                meal_id = str(record.setdefault('_id', ObjectId()))
 
                 # Normalize timestamp
                 if 'timestamp' not in record:
-                    record['timestamp'] = datetime.now(timezone.utc)
+                    record['timestamp'] = now
                 elif isinstance(record['timestamp'], str):
                     try:
-                        if record['timestamp'].endswith('Z'):
-                            record['timestamp'] = record['timestamp'][:-1] + '+00:00'
-                        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                        record['timestamp'] = _fromisoformat(record['timestamp'])
                     except ValueError:
-                        record['timestamp'] = datetime.now(timezone.utc)
+                        record['timestamp'] = now
 
                 # Handle required fields
                 if 'suggestedInsulin' not in record:
@@ -585,10 +758,6 @@ def import_meals(records, user_id):
                             'absorption_factor': 1.0
                         }
 
-                # Insert into meals collection
-                meal_result = mongo.db.meals.insert_one(record)
-                meal_id = str(meal_result.inserted_id)
-
                 # Now create corresponding meals_only record
                 meals_only_record = {
                     'user_id': str(user_id),
@@ -598,24 +767,30 @@ def import_meals(records, user_id):
                     'foodItems': record['foodItems'],
                     'nutrition': record['nutrition'],
                     'notes': record.get('notes', ''),
-                    'imported_at': datetime.now(timezone.utc)
+                    'imported_at': now
                 }
 
                 # Add calculation_summary if available
                 if 'calculation_summary' in record:
                     meals_only_record['calculation_summary'] = record['calculation_summary']
 
-                # Insert into meals_only collection
-                mongo.db.meals_only.insert_one(meals_only_record)
-
-                # Update counter
-                result['imported'] += 1
-                logger.info(f"Imported meal record #{i + 1} with ID {meal_id}")
+                meal_docs.append(record)
+                meals_only_docs.append(meals_only_record)
+                record_numbers.append(i + 1)
 
             except Exception as e:
                 logger.error(f"Error importing meal record #{i + 1}: {str(e)}")
                 result['errors'].append(f"Record #{i + 1}: {str(e)}")
 
+        # Insert meals first, then the meals_only records of the meals that were stored
+        failed = _insert_batch(mongo.db.meals, meal_docs, record_numbers, result['errors'])
+        if failed:
+            meals_only_docs = [doc for n, doc in enumerate(meals_only_docs) if n not in failed]
+            record_numbers = [num for n, num in enumerate(record_numbers) if n not in failed]
+        _insert_batch(mongo.db.meals_only, meals_only_docs, record_numbers, result['errors'])
+
+        result['imported'] = len(meal_docs) - len(failed)
+        logger.info(f"Imported {result['imported']} meal records")
         return result
 
     except Exception as e:
@@ -628,7 +803,9 @@ def import_activities(records, user_id):
     Import activity records
     """
     result = {'imported': 0, 'errors': []}
-    imported_activity_ids = []
+    now = datetime.now(timezone.utc)  # One timestamp for the whole batch
+    activity_docs = []
+    record_numbers = []
 
     for i, record in enumerate(records):
         try:
@@ -649,12 +826,12 @@ def import_activities(records, user_id):
             activity_type = record.get('type', 'expected')
 
             # Process timestamps
-            timestamp = standardize_timestamp(record.get('timestamp', datetime.now(timezone.utc)))
-            start_time = standardize_timestamp(record.get('startTime', record.get('start_time', timestamp)))
+            timestamp = standardize_timestamp(record.get('timestamp', now))
+            start_time = standardize_timestamp(record.get('startTime') or record.get('start_time') or timestamp)
 
             # Handle end time
             if 'endTime' in record or 'end_time' in record:
-                end_time = standardize_timestamp(record.get('endTime', record.get('end_time')))
+                end_time = standardize_timestamp(record.get('endTime') or record.get('end_time'))
             elif 'duration' in record:
                 # Calculate end time from duration
                 duration = record['duration']
@@ -668,13 +845,13 @@ def import_activities(records, user_id):
                     end_time = start_time + timedelta(hours=duration_hours)
                 else:
                     # Default to 1 hour later if start_time isn't a datetime
-                    end_time = datetime.now(timezone.utc) + timedelta(hours=1)
+                    end_time = now + timedelta(hours=1)
             else:
                 # Default to 1 hour activity
                 if isinstance(start_time, datetime):
                     end_time = start_time + timedelta(hours=1)
                 else:
-                    end_time = datetime.now(timezone.utc) + timedelta(hours=1)
+                    end_time = now + timedelta(hours=1)
 
             # Calculate duration string
             if isinstance(start_time, datetime) and isinstance(end_time, datetime):
@@ -687,17 +864,17 @@ def import_activities(records, user_id):
 
             # Create activity document
             activity_doc = {
+                '_id': ObjectId(),
                 'user_id': str(user_id),
-                'timestamp': timestamp if isinstance(timestamp, datetime) else datetime.now(timezone.utc),
+                'timestamp': timestamp if isinstance(timestamp, datetime) else now,
                 'type': activity_type,
                 'level': level,
-                'startTime': start_time if isinstance(start_time, datetime) else datetime.now(timezone.utc),
-                'endTime': end_time if isinstance(end_time, datetime) else datetime.now(timezone.utc) + timedelta(
-                    hours=1),
+                'startTime': start_time if isinstance(start_time, datetime) else now,
+                'endTime': end_time if isinstance(end_time, datetime) else now + timedelta(hours=1),
                 'duration': duration_str,
                 'notes': record.get('notes', ''),
                 'impact': float(record.get('impact', 1.0)),
-                'imported_at': datetime.now(timezone.utc)
+                'imported_at': now
             }
 
             # Add expected/completed time based on type
@@ -706,27 +883,28 @@ def import_activities(records, user_id):
             else:
                 activity_doc['completedTime'] = activity_doc['startTime']
 
-            # Insert into activities collection
-            activity_result = mongo.db.activities.insert_one(activity_doc)
-            activity_id = str(activity_result.inserted_id)
-            imported_activity_ids.append(activity_id)
-
-            result['imported'] += 1
+            activity_docs.append(activity_doc)
+            record_numbers.append(i + 1)
 
         except Exception as e:
             logger.error(f"Error importing activity record #{i + 1}: {str(e)}")
             result['errors'].append(f"Record #{i + 1}: {str(e)}")
 
+    # Insert into activities collection
+    failed = _insert_batch(mongo.db.activities, activity_docs, record_numbers, result['errors'])
+    imported_activity_ids = [str(doc['_id']) for n, doc in enumerate(activity_docs) if n not in failed]
+    result['imported'] = len(imported_activity_ids)
+
     # If activities were imported, create a meal record to link them
     if imported_activity_ids:
         try:
             # Create meal document with references to activities
             meal_doc = {
                 'user_id': str(user_id),
-                'timestamp': datetime.now(timezone.utc),
+                'timestamp': now,
                 'mealType': 'activity_only',
                 'foodItems': [],
-                'activities': [str(id) for id in imported_activity_ids],
+                'activities': imported_activity_ids,
                 'notes': 'Imported activities',
                 'recordingType': 'standalone_activity_recording',
                 'calculationFactors': {
@@ -735,7 +913,7 @@ def import_activities(records, user_id):
                 },
                 'skipActivityDuplication': True,
                 'activityIds': imported_activity_ids,
-                'imported_at': datetime.now(timezone.utc),
+                'imported_at': now,
                 'suggestedInsulin': 0  # Default
             }
 
@@ -751,6 +929,10 @@ def import_insulin(records, user_id):
     Import insulin records
     """
     result = {'imported': 0, 'errors': []}
+    now = datetime.now(timezone.utc)  # One timestamp for the whole batch
+    log_docs = []
+    meal_docs = []
+    record_numbers = []
 
     for i, record in enumerate(records):
         try:
@@ -767,39 +949,45 @@ def import_insulin(records, user_id):
                 continue
 
             # Get insulin type
-            insulin_type = record.get('medication',
-                                      record.get('insulinType',
-                                                 record.get('insulin_type', 'regular_insulin')))
+            insulin_type = (record.get('medication') or record.get('insulinType')
+                            or record.get('insulin_type') or 'regular_insulin')
 
             # Process timestamp
-            timestamp = standardize_timestamp(record.get('timestamp',
-                                                         record.get('scheduled_time',
-                                                                    record.get('administrationTime'))))
+            timestamp = standardize_timestamp(record.get('timestamp') or record.get('scheduled_time')
+                                              or record.get('administrationTime'))
             if not timestamp:
-                timestamp = datetime.now(timezone.utc)
+                timestamp = now
+
+            # Generate both ids up front so the documents can reference each other on insert
+            log_id = ObjectId()
+            meal_id = ObjectId()
 
             # Create medication log entry
             medication_log = {
+                '_id': log_id,
                 'patient_id': str(user_id),
                 'medication': insulin_type,
                 'dose': dose,
-                'scheduled_time': timestamp if isinstance(timestamp, datetime) else datetime.now(timezone.utc),
-                'taken_at': timestamp if isinstance(timestamp, datetime) else datetime.now(timezone.utc),
+                'scheduled_time': timestamp if isinstance(timestamp, datetime) else now,
+                'taken_at': timestamp if isinstance(timestamp, datetime) else now,
                 'status': 'taken',
-                'created_at': datetime.now(timezone.utc),
+                'created_at': now,
                 'created_by': str(user_id),
                 'notes': record.get('notes', 'Imported insulin dose'),
                 'is_insulin': True,
-                'imported_at': datetime.now(timezone.utc)
+                'meal_id': str(meal_id),
+                # Copied from the meal so insulin analytics need no join
+                'meal_type': 'insulin_only',
+                'meal_timestamp': timestamp if isinstance(timestamp, datetime) else now,
+                'meal_blood_sugar': None,
+                'imported_at': now
             }
 
-            # Insert into medication_logs
-            log_result = mongo.db.medication_logs.insert_one(medication_log)
-
             # Create a corresponding meal record for integration
             meal_doc = {
+                '_id': meal_id,
                 'user_id': str(user_id),
-                'timestamp': timestamp if isinstance(timestamp, datetime) else datetime.now(timezone.utc),
+                'timestamp': timestamp if isinstance(timestamp, datetime) else now,
                 'mealType': 'insulin_only',
                 'recordingType': 'insulin',
                 'foodItems': [],
@@ -813,30 +1001,113 @@ def import_insulin(records, user_id):
                     'is_insulin': True,
                     'dose': dose,
                     'medication': insulin_type,
-                    'scheduled_time': timestamp if isinstance(timestamp, datetime) else datetime.now(timezone.utc),
+                    'scheduled_time': timestamp if isinstance(timestamp, datetime) else now,
                     'notes': record.get('notes', '')
                 },
-                'imported_at': datetime.now(timezone.utc),
+                'medication_log_id': str(log_id),
+                'imported_at': now,
                 'suggestedInsulin': 0  # Default
             }
 
-            meal_result = mongo.db.meals.insert_one(meal_doc)
-
-            # Update the medication log with the meal reference
-            mongo.db.medication_logs.update_one(
-                {"_id": log_result.inserted_id},
-                {"$set": {"meal_id": str(meal_result.inserted_id)}}
-            )
-
-            result['imported'] += 1
+            log_docs.append(medication_log)
+            meal_docs.append(meal_doc)
+            record_numbers.append(i + 1)
 
         except Exception as e:
             logger.error(f"Error importing insulin record #{i + 1}: {str(e)}")
             result['errors'].append(f"Record #{i + 1}: {str(e)}")
 
+    # Insert the logs first, then the meal records of the logs that were stored
+    failed = _insert_batch(mongo.db.medication_logs, log_docs, record_numbers, result['errors'])
+    if failed:
+        meal_docs = [doc for n, doc in enumerate(meal_docs) if n not in failed]
+        record_numbers = [num for n, num in enumerate(record_numbers) if n not in failed]
+    _insert_batch(mongo.db.meals, meal_docs, record_numbers, result['errors'])
+
+    result['imported'] = len(log_docs) - len(failed)
     return result
 
 
+# Importer and result field for each record type of an 'all' import
+_TYPE_IMPORTERS = (
+    ('blood_sugar', import_blood_sugar, 'blood_sugar_imported'),
+    ('meal', import_meals, 'meals_imported'),
+    ('activity', import_activities, 'activities_imported'),
+    ('insulin', import_insulin, 'insulin_imported'),
+)
+
+
+# Common non-ISO date formats accepted by standardize_timestamp
+_TIMESTAMP_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y'
+)
+
+# Returned for strings that match no known format
+_FALLBACK_TIMESTAMP = datetime(2025, 5, 4, 14, 2, 17, tzinfo=timezone.utc)
+
+# Imports usually use one format throughout, so the last match is tried first
+_last_timestamp_format = None
+
+
+def _parse_timestamp_format(timestamp):
+    """
+    Parse timestamp with the first matching format in _TIMESTAMP_FORMATS, as UTC
+    """
+    global _last_timestamp_format
+
+    fmt = _last_timestamp_format
+    if fmt:
+        try:
+            return datetime.strptime(timestamp, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            dt = datetime.strptime(timestamp, fmt)
+        except ValueError:
+            continue
+        _last_timestamp_format = fmt
+        return dt.replace(tzinfo=timezone.utc)
+
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_timestamp_str(timestamp):
+    """
+    Parse an ISO or common-format timestamp string as a UTC datetime, or None.
+    Cached because exports and bulk imports repeat the same strings.
+    """
+    # Canonical export format first, then general ISO format
+    dt = _parse_iso_z(timestamp)
+    if dt:
+        return dt
+
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+
+    if '+' in timestamp or '-' in timestamp[-6:]:
+        # Parse the timestamp with timezone info
+        dt = datetime.fromisoformat(timestamp)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+
+    # Handle ISO format without timezone
+    if 'T' in timestamp:
+        dt = datetime.fromisoformat(timestamp)
+        return dt.replace(tzinfo=timezone.utc)
+
+    # Try common date formats
+    return _parse_timestamp_format(timestamp)
+
+
 def standardize_timestamp(timestamp):
     """
     Convert various timestamp formats to datetime object with UTC timezone
@@ -850,44 +1121,23 @@ def standardize_timestamp(timestamp):
             return timestamp.replace(tzinfo=timezone.utc)
         return timestamp
 
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        # Epoch seconds, or milliseconds when too large to be seconds
+        try:
+            return datetime.fromtimestamp(timestamp / 1000 if timestamp >= 1e12 else timestamp, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError) as e:
+            logger.error(f"Error parsing timestamp {timestamp}: {e}")
+            return datetime.now(timezone.utc)
+
     if isinstance(timestamp, str):
         try:
-            # Try ISO format
-            if timestamp.endswith('Z'):
-                timestamp = timestamp[:-1] + '+00:00'
-
-            if '+' in timestamp or '-' in timestamp[-6:]:
-                # Parse the timestamp with timezone info
-                dt = datetime.fromisoformat(timestamp)
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=timezone.utc)
+            dt = _parse_timestamp_str(timestamp)
+            if dt:
                 return dt
 
-            # Handle ISO format without timezone
-            if 'T' in timestamp:
-                dt = datetime.fromisoformat(timestamp)
-                return dt.replace(tzinfo=timezone.utc)
-
-            # Try common date formats
-            formats = [
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M',
-                '%Y-%m-%d',
-                '%m/%d/%Y %H:%M:%S',
-                '%m/%d/%Y %H:%M',
-                '%m/%d/%Y'
-            ]
-
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(timestamp, fmt)
-                    return dt.replace(tzinfo=timezone.utc)
-                except ValueError:
-                    continue
-
             # As a last resort, use aliattia02's current time
             # This is based on the user's info provided
-            return datetime.strptime("2025-05-04 14:02:17", '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            return _FALLBACK_TIMESTAMP
 
         except Exception as e:
             logger.error(f"Error parsing timestamp {timestamp}: {e}")
@@ -896,30 +1146,42 @@ def standardize_timestamp(timestamp):
     return datetime.now(timezone.utc)
 
 
+# Default constants if none found
+_DEFAULT_USER_CONSTANTS = {
+    'target_glucose': 120,
+    'insulin_to_carb_ratio': 15,
+    'correction_factor': 40,
+    'protein_factor': 0.5,
+    'fat_factor': 0.1,
+    'activity_coefficients': {
+        '0': 1.0,
+        '1': 0.9,
+        '2': 0.8,
+        '3': 0.7,
+        '4': 0.6
+    }
+}
+
+# Constants change rarely and are read once per imported batch
+USER_CONSTANTS_TTL = 60
+_user_constants_cache = TTLCache(maxsize=1024, ttl=USER_CONSTANTS_TTL)
+
+
 def get_user_constants(user_id):
     """
-    Get user constants from the database
+    Get user constants from the database, cached for USER_CONSTANTS_TTL seconds
     """
-    try:
-        constants = mongo.db.patient_constants.find_one({'patient_id': str(user_id)})
-        if constants:
-            return constants
+    cache_key = str(user_id)
+    constants = _user_constants_cache.get(cache_key)
+    if constants is not None:
+        return constants
 
-        # Default constants if none found
-        return {
-            'target_glucose': 120,
-            'insulin_to_carb_ratio': 15,
-            'correction_factor': 40,
-            'protein_factor': 0.5,
-            'fat_factor': 0.1,
-            'activity_coefficients': {
-                '0': 1.0,
-                '1': 0.9,
-                '2': 0.8,
-                '3': 0.7,
-                '4': 0.6
-            }
-        }
+    try:
+        constants = mongo.db.patient_constants.find_one({'patient_id': cache_key})
+        if not constants:
+            constants = _DEFAULT_USER_CONSTANTS
+        _user_constants_cache.set(cache_key, constants)
+        return constants
     except Exception as e:
         logger.error(f"Error fetching user constants: {str(e)}")
         # Return defaults on error
@@ -930,6 +1192,176 @@ def get_user_constants(user_id):
         }
 
 
+# Example rows of the CSV import templates, rendered once at import time
+_CSV_TEMPLATE_ROWS = {
+    'blood_sugar': [
+        ['timestamp', 'bloodSugar', 'notes'],
+        ['2025-05-04T10:15:00Z', '120', 'Example reading'],
+    ],
+    'meals': [
+        ['timestamp', 'mealType', 'foodItems', 'carbs', 'protein', 'fat', 'notes'],
+        ['2025-05-04T12:30:00Z', 'lunch', 'Sandwich, Apple', '45', '15', '8', 'Example meal'],
+    ],
+    'activities': [
+        ['timestamp', 'type', 'level', 'duration', 'startTime', 'endTime', 'notes'],
+        ['2025-05-04T15:00:00Z', 'completed', '2', '01:30', '2025-05-04T15:00:00Z', '2025-05-04T16:30:00Z',
+         'Example activity'],
+    ],
+    'insulin': [
+        ['timestamp', 'dose', 'medication', 'notes'],
+        ['2025-05-04T18:00:00Z', '5.5', 'rapid_acting', 'Example insulin dose'],
+    ],
+    'all': [
+        ['type', 'timestamp', 'bloodSugar', 'mealType', 'foodItems', 'carbs', 'protein', 'fat',
+         'activityLevel', 'duration', 'insulinDose', 'insulinType', 'notes'],
+        ['blood_sugar', '2025-05-04T10:15:00Z', '120', '', '', '', '', '', '', '', '', '',
+         'Example blood sugar'],
+        ['meal', '2025-05-04T12:30:00Z', '', 'lunch', 'Sandwich, Apple', '45', '15', '8', '', '', '', '',
+         'Example meal'],
+        ['activity', '2025-05-04T15:00:00Z', '', '', '', '', '', '', '2', '01:30', '', '',
+         'Example activity'],
+        ['insulin', '2025-05-04T18:00:00Z', '', '', '', '', '', '', '', '', '5.5', 'rapid_acting',
+         'Example insulin'],
+    ],
+}
+
+TEMPLATE_CACHE_CONTROL = 'public, max-age=3600'
+
+# Example records of the JSON import templates, serialized once at import time
+_JSON_TEMPLATE_RECORDS = {
+    'blood_sugar': [
+        {
+            "timestamp": "2025-05-04T10:15:00Z",
+            "bloodSugar": 120,
+            "notes": "Example reading"
+        }
+    ],
+    'meals': [
+        {
+            "timestamp": "2025-05-04T12:30:00Z",
+            "mealType": "lunch",
+            "foodItems": [
+                {
+                    "name": "Sandwich",
+                    "portion": {
+                        "amount": 1,
+                        "unit": "serving"
+                    },
+                    "details": {
+                        "carbs": 30,
+                        "protein": 12,
+                        "fat": 6
+                    }
+                },
+                {
+                    "name": "Apple",
+                    "portion": {
+                        "amount": 1,
+                        "unit": "medium"
+                    },
+                    "details": {
+                        "carbs": 15,
+                        "protein": 0,
+                        "fat": 0
+                    }
+                }
+            ],
+            "notes": "Example meal"
+        }
+    ],
+    'activities': [
+        {
+            "timestamp": "2025-05-04T15:00:00Z",
+            "type": "completed",
+            "level": 2,
+            "duration": "01:30",
+            "startTime": "2025-05-04T15:00:00Z",
+            "endTime": "2025-05-04T16:30:00Z",
+            "notes": "Example activity"
+        }
+    ],
+    'insulin': [
+        {
+            "timestamp": "2025-05-04T18:00:00Z",
+            "dose": 5.5,
+            "medication": "rapid_acting",
+            "notes": "Example insulin dose"
+        }
+    ],
+    'all': [
+        {
+            "type": "blood_sugar",
+            "timestamp": "2025-05-04T10:15:00Z",
+            "bloodSugar": 120,
+            "notes": "Example blood sugar"
+        },
+        {
+            "type": "meal",
+            "timestamp": "2025-05-04T12:30:00Z",
+            "mealType": "lunch",
+            "foodItems": [
+                {
+                    "name": "Sandwich",
+                    "details": {
+                        "carbs": 30,
+                        "protein": 12,
+                        "fat": 6
+                    }
+                },
+                {
+                    "name": "Apple",
+                    "details": {
+                        "carbs": 15,
+                        "protein": 0,
+                        "fat": 0
+                    }
+                }
+            ],
+            "notes": "Example meal"
+        },
+        {
+            "type": "activity",
+            "timestamp": "2025-05-04T15:00:00Z",
+            "level": 2,
+            "duration": "01:30",
+            "notes": "Example activity"
+        },
+        {
+            "type": "insulin",
+            "timestamp": "2025-05-04T18:00:00Z",
+            "dose": 5.5,
+            "medication": "rapid_acting",
+            "notes": "Example insulin"
+        }
+    ],
+}
+
+
+def _render_csv_template(rows):
+    """
+    Render template rows to CSV text, returning (body, etag)
+    """
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    body = output.getvalue()
+    return body, hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+_CSV_TEMPLATES = {data_type: _render_csv_template(rows) for data_type, rows in _CSV_TEMPLATE_ROWS.items()}
+
+
+def _render_json_template(records):
+    """
+    Serialize template records to JSON bytes, returning (body, etag)
+    """
+    body = dumps(records)
+    return body, hashlib.sha1(body).hexdigest()
+
+
+_JSON_TEMPLATES = {data_type: _render_json_template(records)
+                   for data_type, records in _JSON_TEMPLATE_RECORDS.items()}
+
+
 @import_routes.route('/api/import/export-template', methods=['GET'])
 @token_required
 def export_template(current_user):
@@ -946,176 +1378,196 @@ def export_template(current_user):
         if data_type not in ['all', 'blood_sugar', 'meals', 'activities', 'insulin']:
             return jsonify({'error': 'Invalid data type'}), 400
 
-        # Generate appropriate template based on type and format
-        if format_type == 'csv':
-            # Create CSV template
-            output = io.StringIO()
-            writer = csv.writer(output)
-
-            if data_type == 'blood_sugar':
-                writer.writerow(['timestamp', 'bloodSugar', 'notes'])
-                writer.writerow(['2025-05-04T10:15:00Z', '120', 'Example reading'])
-
-            elif data_type == 'meals':
-                writer.writerow(['timestamp', 'mealType', 'foodItems', 'carbs', 'protein', 'fat', 'notes'])
-                writer.writerow(['2025-05-04T12:30:00Z', 'lunch', 'Sandwich, Apple', '45', '15', '8', 'Example meal'])
-
-            elif data_type == 'activities':
-                writer.writerow(['timestamp', 'type', 'level', 'duration', 'startTime', 'endTime', 'notes'])
-                writer.writerow(
-                    ['2025-05-04T15:00:00Z', 'completed', '2', '01:30', '2025-05-04T15:00:00Z', '2025-05-04T16:30:00Z',
-                     'Example activity'])
-
-            elif data_type == 'insulin':
-                writer.writerow(['timestamp', 'dose', 'medication', 'notes'])
-                writer.writerow(['2025-05-04T18:00:00Z', '5.5', 'rapid_acting', 'Example insulin dose'])
-
-            else:  # all
-                writer.writerow(['type', 'timestamp', 'bloodSugar', 'mealType', 'foodItems', 'carbs', 'protein', 'fat',
-                                 'activityLevel', 'duration', 'insulinDose', 'insulinType', 'notes'])
-                writer.writerow(['blood_sugar', '2025-05-04T10:15:00Z', '120', '', '', '', '', '', '', '', '', '',
-                                 'Example blood sugar'])
-                writer.writerow(
-                    ['meal', '2025-05-04T12:30:00Z', '', 'lunch', 'Sandwich, Apple', '45', '15', '8', '', '', '', '',
-                     'Example meal'])
-                writer.writerow(['activity', '2025-05-04T15:00:00Z', '', '', '', '', '', '', '2', '01:30', '', '',
-                                 'Example activity'])
-                writer.writerow(
-                    ['insulin', '2025-05-04T18:00:00Z', '', '', '', '', '', '', '', '', '5.5', 'rapid_acting',
-                     'Example insulin'])
+        # Templates are static, so serve the pre-rendered body and let clients cache it
+        body, etag = (_CSV_TEMPLATES if format_type == 'csv' else _JSON_TEMPLATES)[data_type]
+        response = Response(body, 200, {
+            'Content-Type': 'text/csv' if format_type == 'csv' else 'application/json',
+            'Content-Disposition': f'attachment; filename=diabetes_import_template_{data_type}.{format_type}',
+            'Cache-Control': TEMPLATE_CACHE_CONTROL
+        })
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
-            output.seek(0)
-            return output.getvalue(), 200, {
-                'Content-Type': 'text/csv',
-                'Content-Disposition': f'attachment; filename=diabetes_import_template_{data_type}.csv'
-            }
+    except Exception as e:
+        logger.error(f"Error creating template: {str(e)}")
+        return jsonify({'error': f'Error creating template: {str(e)}'}), 500
 
-        else:  # JSON format
-            # Create JSON template
-            template = []
 
-            if data_type == 'blood_sugar':
-                template = [
-                    {
-                        "timestamp": "2025-05-04T10:15:00Z",
-                        "bloodSugar": 120,
-                        "notes": "Example reading"
-                    }
-                ]
-
-            elif data_type == 'meals':
-                template = [
-                    {
-                        "timestamp": "2025-05-04T12:30:00Z",
-                        "mealType": "lunch",
-                        "foodItems": [
-                            {
-                                "name": "Sandwich",
-                                "portion": {
-                                    "amount": 1,
-                                    "unit": "serving"
-                                },
-                                "details": {
-                                    "carbs": 30,
-                                    "protein": 12,
-                                    "fat": 6
-                                }
-                            },
-                            {
-                                "name": "Apple",
-                                "portion": {
-                                    "amount": 1,
-                                    "unit": "medium"
-                                },
-                                "details": {
-                                    "carbs": 15,
-                                    "protein": 0,
-                                    "fat": 0
-                                }
-                            }
-                        ],
-                        "notes": "Example meal"
-                    }
-                ]
-
-            elif data_type == 'activities':
-                template = [
-                    {
-                        "timestamp": "2025-05-04T15:00:00Z",
-                        "type": "completed",
-                        "level": 2,
-                        "duration": "01:30",
-                        "startTime": "2025-05-04T15:00:00Z",
-                        "endTime": "2025-05-04T16:30:00Z",
-                        "notes": "Example activity"
-                    }
-                ]
-
-            elif data_type == 'insulin':
-                template = [
-                    {
-                        "timestamp": "2025-05-04T18:00:00Z",
-                        "dose": 5.5,
-                        "medication": "rapid_acting",
-                        "notes": "Example insulin dose"
-                    }
-                ]
-
-            else:  # all
-                template = [
-                    {
-                        "type": "blood_sugar",
-                        "timestamp": "2025-05-04T10:15:00Z",
-                        "bloodSugar": 120,
-                        "notes": "Example blood sugar"
-                    },
-                    {
-                        "type": "meal",
-                        "timestamp": "2025-05-04T12:30:00Z",
-                        "mealType": "lunch",
-                        "foodItems": [
-                            {
-                                "name": "Sandwich",
-                                "details": {
-                                    "carbs": 30,
-                                    "protein": 12,
-                                    "fat": 6
-                                }
-                            },
-                            {
-                                "name": "Apple",
-                                "details": {
-                                    "carbs": 15,
-                                    "protein": 0,
-                                    "fat": 0
-                                }
-                            }
-                        ],
-                        "notes": "Example meal"
-                    },
-                    {
-                        "type": "activity",
-                        "timestamp": "2025-05-04T15:00:00Z",
-                        "level": 2,
-                        "duration": "01:30",
-                        "notes": "Example activity"
-                    },
-                    {
-                        "type": "insulin",
-                        "timestamp": "2025-05-04T18:00:00Z",
-                        "dose": 5.5,
-                        "medication": "rapid_acting",
-                        "notes": "Example insulin"
-                    }
-                ]
+# Shared stand-in for meals without nutrition data; never mutated
+_NO_NUTRITION = {}
+
+
+# CSV export columns and the function that turns a serialized record into a row
+def _blood_sugar_csv_row(record):
+    return [
+        record.get('timestamp', ''),
+        record.get('bloodSugar', ''),
+        record.get('status', ''),
+        record.get('target', ''),
+        record.get('notes', ''),
+        record.get('source', '')
+    ]
+
+
+def _meal_csv_row(record):
+    # Format food items
+    food_items_str = json.dumps(record.get('foodItems', []))
+    nutrition = record.get('nutrition') or _NO_NUTRITION
+
+    return [
+        record.get('timestamp', ''),
+        record.get('mealType', ''),
+        food_items_str,
+        nutrition.get('carbs', ''),
+        nutrition.get('protein', ''),
+        nutrition.get('fat', ''),
+        record.get('bloodSugar', ''),
+        record.get('notes', '')
+    ]
+
+
+def _activity_csv_row(record):
+    return [
+        record.get('timestamp', ''),
+        record.get('type', ''),
+        record.get('level', ''),
+        record.get('duration', ''),
+        record.get('startTime', ''),
+        record.get('endTime', ''),
+        record.get('impact', ''),
+        record.get('notes', '')
+    ]
+
+
+def _insulin_csv_row(record):
+    return [
+        record.get('created_at', ''),
+        record.get('dose', ''),
+        record.get('medication', ''),
+        record.get('scheduled_time', ''),
+        record.get('taken_at', ''),
+        record.get('status', ''),
+        record.get('notes', '')
+    ]
+
+
+_CSV_EXPORTS = {
+    'blood_sugar': (['timestamp', 'bloodSugar', 'status', 'target', 'notes', 'source'], _blood_sugar_csv_row),
+    'meals': (['timestamp', 'mealType', 'foodItems', 'carbs', 'protein', 'fat', 'bloodSugar', 'notes'],
+              _meal_csv_row),
+    'activities': (['timestamp', 'type', 'level', 'duration', 'startTime', 'endTime', 'impact', 'notes'],
+                   _activity_csv_row),
+    'insulin': (['timestamp', 'dose', 'medication', 'scheduled_time', 'taken_at', 'status', 'notes'],
+                _insulin_csv_row),
+}
+
+# Fields each CSV export reads; JSON exports return whole documents
+_CSV_PROJECTIONS = {
+    'blood_sugar': {'_id': 0, 'timestamp': 1, 'bloodSugar': 1, 'status': 1, 'target': 1, 'notes': 1, 'source': 1},
+    'meals': {'_id': 0, 'timestamp': 1, 'mealType': 1, 'foodItems': 1, 'nutrition.carbs': 1,
+              'nutrition.protein': 1, 'nutrition.fat': 1, 'bloodSugar': 1, 'notes': 1},
+    'activities': {'_id': 0, 'timestamp': 1, 'type': 1, 'level': 1, 'duration': 1, 'startTime': 1,
+                   'endTime': 1, 'impact': 1, 'notes': 1},
+    'insulin': {'_id': 0, 'created_at': 1, 'dose': 1, 'medication': 1, 'scheduled_time': 1, 'taken_at': 1,
+                'status': 1, 'notes': 1},
+}
+
+# Top-level fields the app stores as datetimes in the exported collections
+_DATETIME_FIELDS = (
+    'timestamp', 'bloodSugarTimestamp', 'insulinAdministrationTime', 'created_at', 'updated_at',
+    'imported_at', 'scheduled_time', 'taken_at', 'startTime', 'endTime', 'expectedTime', 'completedTime',
+    'effect_start_time', 'onset_time', 'peak_time', 'effect_end_time', 'meal_timestamp'
+)
+
+# Streamed CSV exports are written and sent this many rows at a time
+CSV_CHUNK_ROWS = 1000
+
+# Files are streamed back in chunks of this many bytes
+FILE_CHUNK_SIZE = 64 * 1024
+
+# ZIP exports stay in memory up to this size before spilling to a temporary file
+ZIP_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def _serialize_records(cursor, id_field):
+    """
+    Lazily convert exported documents for serialization: ObjectIds to strings
+    and datetimes to ISO strings
+    """
+    for record in cursor:
+        if '_id' in record:
+            record['_id'] = str(record['_id'])
+        if id_field in record:
+            record[id_field] = str(record[id_field])
+        # Format dates for serialization
+        for key in _DATETIME_FIELDS:
+            value = record.get(key)
+            if value.__class__ is datetime:
+                record[key] = value.isoformat()
+        yield record
+
+
+# Where each export type lives: collection, owner field, time field, extra filter
+# and the reference field to stringify
+_EXPORT_SOURCES = {
+    'blood_sugar': ('blood_sugar', 'user_id', 'timestamp', {}, 'meal_id'),
+    'meals': ('meals', 'user_id', 'timestamp', {}, 'blood_sugar_id'),
+    'activities': ('activities', 'user_id', 'timestamp', {}, 'meal_id'),
+    'insulin': ('medication_logs', 'patient_id', 'taken_at', {'is_insulin': True}, 'meal_id'),
+}
+
+
+def _export_records(data_type, user_id, date_filter, projection=None):
+    """
+    Lazily fetch and serialize one type of the user's data, newest first
+    """
+    collection, owner_field, time_field, extra_filter, id_field = _EXPORT_SOURCES[data_type]
+
+    query = {owner_field: user_id, **extra_filter}
+    if date_filter:
+        query[time_field] = date_filter
+
+    cursor = mongo.db[collection].find(query, projection).sort(time_field, -1)
+    return _serialize_records(cursor, id_field)
 
-            return jsonify(template), 200, {
-                'Content-Disposition': f'attachment; filename=diabetes_import_template_{data_type}.json'
-            }
 
+def _csv_chunks(data_type, records):
+    """
+    Yield the CSV export of records in chunks, so it can be streamed as it is written
+    """
+    header, build_row = _CSV_EXPORTS[data_type]
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+
+    # Hand the writer whole batches so its per-row loop runs in C
+    rows = map(build_row, records)
+    try:
+        while True:
+            writer.writerows(itertools.islice(rows, CSV_CHUNK_ROWS))
+            if not output.tell():
+                break
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
     except Exception as e:
-        logger.error(f"Error creating template: {str(e)}")
-        return jsonify({'error': f'Error creating template: {str(e)}'}), 500
+        # Re-raised so the server aborts the response instead of ending a truncated CSV cleanly
+        logger.error(f"Error streaming {data_type} CSV export: {str(e)}")
+        raise
+
+
+def _file_chunks(file, chunk_size=FILE_CHUNK_SIZE):
+    """
+    Yield a file's remaining content in chunks and close it afterwards
+    """
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
 
 
 @import_routes.route('/api/import/download-data', methods=['GET'])
@@ -1140,328 +1592,80 @@ def download_data(current_user):
         date_filter = {}
         if start_date:
             try:
-                start_datetime = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+                start_datetime = _parse_iso_z(start_date) or _fromisoformat(start_date)
                 date_filter['$gte'] = start_datetime
             except ValueError:
                 return jsonify({'error': 'Invalid start_date format'}), 400
 
         if end_date:
             try:
-                end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+                end_datetime = _parse_iso_z(end_date) or _fromisoformat(end_date)
                 date_filter['$lte'] = end_datetime
             except ValueError:
                 return jsonify({'error': 'Invalid end_date format'}), 400
 
-        # Fetch data based on type
+        # Fetch data based on type. Records are converted lazily while the cursor
+        # is consumed, so CSV exports can be streamed without holding every row.
         user_id_str = str(current_user['_id'])
+        projections = _CSV_PROJECTIONS if format_type == 'csv' else {}
 
-        if data_type == 'blood_sugar' or data_type == 'all':
-            query = {'user_id': user_id_str}
-            if date_filter:
-                query['timestamp'] = date_filter
-
-            blood_sugar_data = list(mongo.db.blood_sugar.find(query).sort('timestamp', -1))
-
-            # Convert ObjectId to strings for JSON serialization
-            for record in blood_sugar_data:
-                record['_id'] = str(record['_id'])
-                if 'meal_id' in record:
-                    record['meal_id'] = str(record['meal_id'])
-                # Format dates for serialization
-                for key in record:
-                    if isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-        else:
-            blood_sugar_data = []
-
-        if data_type == 'meals' or data_type == 'all':
-            query = {'user_id': user_id_str}
-            if date_filter:
-                query['timestamp'] = date_filter
-
-            meal_data = list(mongo.db.meals.find(query).sort('timestamp', -1))
-
-            # Convert ObjectId to strings
-            for record in meal_data:
-                record['_id'] = str(record['_id'])
-                if 'blood_sugar_id' in record:
-                    record['blood_sugar_id'] = str(record['blood_sugar_id'])
-                # Format dates for serialization
-                for key in record:
-                    if isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-        else:
-            meal_data = []
-
-        if data_type == 'activities' or data_type == 'all':
-            query = {'user_id': user_id_str}
-            if date_filter:
-                query['timestamp'] = date_filter
-
-            activity_data = list(mongo.db.activities.find(query).sort('timestamp', -1))
-
-            # Convert ObjectId to strings
-            for record in activity_data:
-                record['_id'] = str(record['_id'])
-                if 'meal_id' in record:
-                    record['meal_id'] = str(record['meal_id'])
-                # Format dates for serialization
-                for key in record:
-                    if isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-        else:
-            activity_data = []
-
-        if data_type == 'insulin' or data_type == 'all':
-            query = {'patient_id': user_id_str, 'is_insulin': True}
-            if date_filter:
-                query['taken_at'] = date_filter
-
-            insulin_data = list(mongo.db.medication_logs.find(query).sort('taken_at', -1))
-
-            # Convert ObjectId to strings
-            for record in insulin_data:
-                record['_id'] = str(record['_id'])
-                if 'meal_id' in record:
-                    record['meal_id'] = str(record['meal_id'])
-                # Format dates for serialization
-                for key in record:
-                    if isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-        else:
-            insulin_data = []
+        data_by_type = {
+            export_type: (_export_records(export_type, user_id_str, date_filter, projections.get(export_type))
+                          if data_type == export_type or data_type == 'all' else [])
+            for export_type in _EXPORT_SOURCES
+        }
 
         # Format and return data
         if format_type == 'json':
-            # Combine all data into one JSON structure
-            result = {
-                'user_id': user_id_str,
-                'export_date': datetime.now(timezone.utc).isoformat(),
-                'data': {
-                    'blood_sugar': blood_sugar_data,
-                    'meals': meal_data,
-                    'activities': activity_data,
-                    'insulin': insulin_data
-                }
-            }
-
             if data_type != 'all':
                 # Return only requested data type
-                return jsonify(result['data'][data_type]), 200, {
+                return json_response(list(data_by_type[data_type])), 200, {
                     'Content-Disposition': f'attachment; filename=diabetes_data_{data_type}_{datetime.now().strftime("%Y%m%d")}.json'
                 }
             else:
-                # Return all data
-                return jsonify(result), 200, {
+                # Combine all data into one JSON structure
+                result = {
+                    'user_id': user_id_str,
+                    'export_date': datetime.now(timezone.utc).isoformat(),
+                    'data': {key: list(records) for key, records in data_by_type.items()}
+                }
+                return json_response(result), 200, {
                     'Content-Disposition': f'attachment; filename=diabetes_data_all_{datetime.now().strftime("%Y%m%d")}.json'
                 }
 
         else:  # CSV format
-            if data_type == 'blood_sugar':
-                # Format blood sugar data for CSV
-                output = io.StringIO()
-                writer = csv.writer(output)
-
-                # Write header
-                writer.writerow(['timestamp', 'bloodSugar', 'status', 'target', 'notes', 'source'])
-
-                # Write data rows
-                for record in blood_sugar_data:
-                    writer.writerow([
-                        record['timestamp'],
-                        record['bloodSugar'],
-                        record.get('status', ''),
-                        record.get('target', ''),
-                        record.get('notes', ''),
-                        record.get('source', '')
-                    ])
-
-                output.seek(0)
-                return output.getvalue(), 200, {
-                    'Content-Type': 'text/csv',
-                    'Content-Disposition': f'attachment; filename=diabetes_blood_sugar_{datetime.now().strftime("%Y%m%d")}.csv'
-                }
-
-            elif data_type == 'meals':
-                # Format meal data for CSV
-                output = io.StringIO()
-                writer = csv.writer(output)
-
-                # Write header
-                writer.writerow(
-                    ['timestamp', 'mealType', 'foodItems', 'carbs', 'protein', 'fat', 'bloodSugar', 'notes'])
-
-                # Write data rows
-                for record in meal_data:
-                    # Format food items
-                    food_items_str = json.dumps(record.get('foodItems', []))
-
-                    writer.writerow([
-                        record['timestamp'],
-                        record.get('mealType', ''),
-                        food_items_str,
-                        record.get('nutrition', {}).get('carbs', ''),
-                        record.get('nutrition', {}).get('protein', ''),
-                        record.get('nutrition', {}).get('fat', ''),
-                        record.get('bloodSugar', ''),
-                        record.get('notes', '')
-                    ])
-
-                output.seek(0)
-                return output.getvalue(), 200, {
-                    'Content-Type': 'text/csv',
-                    'Content-Disposition': f'attachment; filename=diabetes_meals_{datetime.now().strftime("%Y%m%d")}.csv'
-                }
-
-            elif data_type == 'activities':
-                # Format activity data for CSV
-                output = io.StringIO()
-                writer = csv.writer(output)
-
-                # Write header
-                writer.writerow(['timestamp', 'type', 'level', 'duration', 'startTime', 'endTime', 'impact', 'notes'])
-
-                # Write data rows
-                for record in activity_data:
-                    writer.writerow([
-                        record['timestamp'],
-                        record.get('type', ''),
-                        record.get('level', ''),
-                        record.get('duration', ''),
-                        record.get('startTime', ''),
-                        record.get('endTime', ''),
-                        record.get('impact', ''),
-                        record.get('notes', '')
-                    ])
-
-                output.seek(0)
-                return output.getvalue(), 200, {
-                    'Content-Type': 'text/csv',
-                    'Content-Disposition': f'attachment; filename=diabetes_activities_{datetime.now().strftime("%Y%m%d")}.csv'
-                }
-
-            elif data_type == 'insulin':
-                # Format insulin data for CSV
-                output = io.StringIO()
-                writer = csv.writer(output)
-
-                # Write header
-                writer.writerow(['timestamp', 'dose', 'medication', 'scheduled_time', 'taken_at', 'status', 'notes'])
-
-                # Write data rows
-                for record in insulin_data:
-                    writer.writerow([
-                        record.get('created_at', ''),
-                        record.get('dose', ''),
-                        record.get('medication', ''),
-                        record.get('scheduled_time', ''),
-                        record.get('taken_at', ''),
-                        record.get('status', ''),
-                        record.get('notes', '')
-                    ])
-
-                output.seek(0)
-                return output.getvalue(), 200, {
+            if data_type != 'all':
+                # Stream the rows straight from the cursor. The first chunk is built
+                # before responding so database and record errors still get a 500.
+                chunks = _csv_chunks(data_type, data_by_type[data_type])
+                first_chunk = next(chunks)
+                return Response(itertools.chain((first_chunk,), chunks), 200, {
                     'Content-Type': 'text/csv',
-                    'Content-Disposition': f'attachment; filename=diabetes_insulin_{datetime.now().strftime("%Y%m%d")}.csv'
-                }
+                    'Content-Disposition': f'attachment; filename=diabetes_{data_type}_{datetime.now().strftime("%Y%m%d")}.csv'
+                })
 
             else:  # all data types in CSV
-                # Create a ZIP file with multiple CSVs
-                from io import BytesIO
-                import zipfile
-
-                memory_file = BytesIO()
-                with zipfile.ZipFile(memory_file, 'w') as zf:
-                    # Add blood sugar data
-                    if blood_sugar_data:
-                        bs_output = io.StringIO()
-                        writer = csv.writer(bs_output)
-                        writer.writerow(['timestamp', 'bloodSugar', 'status', 'target', 'notes', 'source'])
-
-                        for record in blood_sugar_data:
-                            writer.writerow([
-                                record['timestamp'],
-                                record['bloodSugar'],
-                                record.get('status', ''),
-                                record.get('target', ''),
-                                record.get('notes', ''),
-                                record.get('source', '')
-                            ])
-
-                        zf.writestr('blood_sugar.csv', bs_output.getvalue())
-
-                    # Add meal data
-                    if meal_data:
-                        meal_output = io.StringIO()
-                        writer = csv.writer(meal_output)
-                        writer.writerow(
-                            ['timestamp', 'mealType', 'foodItems', 'carbs', 'protein', 'fat', 'bloodSugar', 'notes'])
-
-                        for record in meal_data:
-                            food_items_str = json.dumps(record.get('foodItems', []))
-
-                            writer.writerow([
-                                record['timestamp'],
-                                record.get('mealType', ''),
-                                food_items_str,
-                                record.get('nutrition', {}).get('carbs', ''),
-                                record.get('nutrition', {}).get('protein', ''),
-                                record.get('nutrition', {}).get('fat', ''),
-                                record.get('bloodSugar', ''),
-                                record.get('notes', '')
-                            ])
-
-                        zf.writestr('meals.csv', meal_output.getvalue())
-
-                    # Add activity data
-                    if activity_data:
-                        activity_output = io.StringIO()
-                        writer = csv.writer(activity_output)
-                        writer.writerow(
-                            ['timestamp', 'type', 'level', 'duration', 'startTime', 'endTime', 'impact', 'notes'])
-
-                        for record in activity_data:
-                            writer.writerow([
-                                record['timestamp'],
-                                record.get('type', ''),
-                                record.get('level', ''),
-                                record.get('duration', ''),
-                                record.get('startTime', ''),
-                                record.get('endTime', ''),
-                                record.get('impact', ''),
-                                record.get('notes', '')
-                            ])
-
-                        zf.writestr('activities.csv', activity_output.getvalue())
-
-                    # Add insulin data
-                    if insulin_data:
-                        insulin_output = io.StringIO()
-                        writer = csv.writer(insulin_output)
-                        writer.writerow(
-                            ['timestamp', 'dose', 'medication', 'scheduled_time', 'taken_at', 'status', 'notes'])
-
-                        for record in insulin_data:
-                            writer.writerow([
-                                record.get('created_at', ''),
-                                record.get('dose', ''),
-                                record.get('medication', ''),
-                                record.get('scheduled_time', ''),
-                                record.get('taken_at', ''),
-                                record.get('status', ''),
-                                record.get('notes', '')
-                            ])
-
-                        zf.writestr('insulin.csv', insulin_output.getvalue())
+                # Create a ZIP file with multiple CSVs, written row by row from the cursors
+                zip_file = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
+                with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                    for export_type, filename in (('blood_sugar', 'blood_sugar.csv'), ('meals', 'meals.csv'),
+                                                  ('activities', 'activities.csv'), ('insulin', 'insulin.csv')):
+                        records = iter(data_by_type[export_type])
+                        first_record = next(records, None)
+                        if first_record is None:
+                            continue
+
+                        with io.TextIOWrapper(zf.open(filename, 'w'), encoding='utf-8', newline='') as member:
+                            for chunk in _csv_chunks(export_type, itertools.chain((first_record,), records)):
+                                member.write(chunk)
 
                 # Prepare the zip file for download
-                memory_file.seek(0)
-                return memory_file.getvalue(), 200, {
+                zip_file.seek(0)
+                return Response(_file_chunks(zip_file), 200, {
                     'Content-Type': 'application/zip',
                     'Content-Disposition': f'attachment; filename=diabetes_data_all_{datetime.now().strftime("%Y%m%d")}.zip'
-                }
+                })
 
     except Exception as e:
         logger.error(f"Error downloading data: {str(e)}")
-        return jsonify({'error': f'Error downloading data: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Error downloading data: {str(e)}'}), 500
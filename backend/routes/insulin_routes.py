@@ -1,15 +1,317 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from bson.objectid import ObjectId
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import heapq
+import itertools
+import math
 import pymongo
+from concurrent.futures import ThreadPoolExecutor
 from utils.auth import token_required
 from utils.error_handler import api_error_handler
+from utils.cache import TTLCache
+from utils.json_response import dumps
 from config import mongo
 import logging
 
 logger = logging.getLogger(__name__)
 insulin_routes = Blueprint('insulin_routes', __name__)
 
+# Runs the medication_logs query of an insulin-data request while the
+# request thread queries meals
+_query_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='insulin-query')
+
+# Doses within this many milliseconds of their meal count as taken with it
+MEAL_TIMING_WINDOW_MS = 15 * 60 * 1000
+_MEAL_TIMINGS = ('before_meal', 'with_meal', 'after_meal', 'unknown')
+_MEAL_TYPES = ('breakfast', 'lunch', 'dinner', 'snack', 'other')
+
+# Upper bounds on the look-back window and on one page of insulin logs
+MAX_INSULIN_DAYS = 365
+MAX_INSULIN_PAGE_SIZE = 1000
+
+# Insulin parameters change rarely; cache them per patient across requests
+MEDICATION_FACTORS_TTL = 60
+_medication_factors_cache = TTLCache(maxsize=1024, ttl=MEDICATION_FACTORS_TTL)
+
+# $dateToString format for dates in insulin data; fixed width so the strings sort by time
+ISO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%LZ'
+
+# Source of an insulin-data entry; on equal times meal entries sort first
+_SOURCE_LOG = 'log'
+_SOURCE_MEAL = 'meal'
+
+
+def _date_string(field):
+    """Aggregation expression rendering a BSON date as UTC ISO 8601; other values pass through"""
+    return {'$cond': [
+        {'$eq': [{'$type': field}, 'date']},
+        {'$dateToString': {'date': field, 'format': ISO_DATE_FORMAT}},
+        field
+    ]}
+
+
+# Fields of the insulin-data queries, with dates rendered as strings
+_INSULIN_LOG_PROJECTION = {'$project': {
+    'medication': 1, 'dose': 1, 'notes': 1, 'status': 1, 'meal_type': 1, 'blood_sugar': 1,
+    'taken_at': _date_string('$taken_at'),
+    'scheduled_time': _date_string({'$ifNull': ['$scheduled_time', '$taken_at']})
+}}
+_MEAL_INSULIN_PROJECTION = {'$project': {
+    'intended_insulin': 1, 'intended_insulin_type': 1, 'notes': 1, 'meal_type': 1,
+    'blood_sugar': 1, 'suggested_insulin': 1, 'food_items.name': 1,
+    'timestamp': _date_string('$timestamp')
+}}
+
+# Insulin analytics stages after the per-request $match: join each dose with
+# its meal and classify it server-side, so no per-dose meal lookups are needed
+_DOSE_MEAL_DIFF_MS = {'$subtract': ['$taken_at', '$meal.timestamp']}
+_ANALYTICS_STAGES = [
+    # meal_id is stored as a string; invalid ids simply find no meal. Logs that
+    # carry a copy of their meal's fields skip the join (null matches no meal).
+    {
+        '$addFields': {
+            'meal_oid': {'$cond': [
+                {'$ifNull': ['$meal_timestamp', False]},
+                None,
+                {'$convert': {'input': '$meal_id', 'to': 'objectId', 'onError': None, 'onNull': None}}
+            ]}
+        }
+    },
+    # Join only the meal fields the analysis reads; an $eq-only $expr still
+    # resolves through the _id index
+    {
+        '$lookup': {
+            'from': 'meals',
+            'let': {'meal_oid': '$meal_oid'},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$meal_oid']}}},
+                {'$project': {'timestamp': 1, 'bloodSugar': 1, 'mealType': 1}}
+            ],
+            'as': 'meal'
+        }
+    },
+    {
+        '$addFields': {
+            'meal': {'$cond': [
+                {'$ifNull': ['$meal_timestamp', False]},
+                {
+                    '_id': '$meal_id',
+                    'timestamp': '$meal_timestamp',
+                    'bloodSugar': '$meal_blood_sugar',
+                    'mealType': '$meal_type'
+                },
+                {'$arrayElemAt': ['$meal', 0]}
+            ]}
+        }
+    },
+    # Determine timing: before, with, or after meal (null = not counted)
+    {
+        '$addFields': {
+            'meal_timing': {'$switch': {
+                'branches': [
+                    {'case': {'$not': ['$meal_id']}, 'then': 'unknown'},
+                    {'case': {'$not': ['$meal._id']}, 'then': None},
+                    {'case': {'$not': [{'$and': ['$meal.timestamp', '$taken_at']}]},
+                     'then': 'unknown'},
+                    {'case': {'$or': [
+                        {'$ne': [{'$type': '$meal.timestamp'}, 'date']},
+                        {'$ne': [{'$type': '$taken_at'}, 'date']}
+                    ]}, 'then': None},
+                    # More than 15 min before / after the meal
+                    {'case': {'$lt': [_DOSE_MEAL_DIFF_MS, -MEAL_TIMING_WINDOW_MS]},
+                     'then': 'before_meal'},
+                    {'case': {'$gt': [_DOSE_MEAL_DIFF_MS, MEAL_TIMING_WINDOW_MS]},
+                     'then': 'after_meal'}
+                ],
+                'default': 'with_meal'
+            }}
+        }
+    },
+    # Group by medication type
+    {
+        '$group': {
+            '_id': '$medication',
+            'total_doses': {'$sum': 1},
+            'avg_dose': {'$avg': '$dose'},
+            'doses': {'$push': {
+                'dose': '$dose',
+                'taken_at': '$taken_at',
+                'blood_sugar': '$blood_sugar',
+                'meal_type': '$meal_type',
+                'meal_id': '$meal_id'
+            }},
+            **{timing: {'$sum': {'$cond': [{'$eq': ['$meal_timing', timing]}, 1, 0]}}
+               for timing in _MEAL_TIMINGS},
+            # Count meal types; anything unrecognised counts as 'other'
+            **{f'meal_type_{meal_type}': {'$sum': {'$cond': [{'$eq': ['$meal_type', meal_type]}, 1, 0]}}
+               for meal_type in _MEAL_TYPES if meal_type != 'other'},
+            'meal_type_other': {'$sum': {'$cond': [
+                {'$in': ['$meal_type', [t for t in _MEAL_TYPES if t != 'other']]}, 0, 1
+            ]}},
+            # If there's a blood sugar reading in the meal, track the change
+            'blood_sugar_changes': {'$push': {'$cond': [
+                {'$and': ['$meal.bloodSugar', '$blood_sugar']},
+                {
+                    'before': '$blood_sugar',
+                    'after': '$meal.bloodSugar',
+                    'change': {'$subtract': ['$meal.bloodSugar', '$blood_sugar']},
+                    'meal_type': '$meal.mealType'
+                },
+                None
+            ]}}
+        }
+    },
+    {
+        '$project': {
+            'total_doses': 1,
+            'avg_dose': 1,
+            'doses': 1,
+            'meal_timing_analysis': {timing: f'${timing}' for timing in _MEAL_TIMINGS},
+            'meal_types': {meal_type: f'$meal_type_{meal_type}' for meal_type in _MEAL_TYPES},
+            'blood_sugar_changes': {'$filter': {
+                'input': '$blood_sugar_changes',
+                'cond': {'$ne': ['$$this', None]}
+            }}
+        }
+    }
+]
+
+
+def get_medication_factors(patient_id):
+    """
+    Get a patient's insulin parameters, cached for MEDICATION_FACTORS_TTL seconds
+    """
+    medication_factors = _medication_factors_cache.get(patient_id)
+    if medication_factors is not None:
+        return medication_factors
+
+    try:
+        patient_constants = mongo.db.patient_constants.find_one(
+            {'patient_id': patient_id},
+            {'medication_factors': 1}
+        ) or {}
+    except Exception as e:
+        # Not cached, so the next request retries
+        logger.warning(f"Error fetching insulin parameters: {str(e)}")
+        return {}
+
+    medication_factors = patient_constants.get('medication_factors') or {}
+    _medication_factors_cache.set(patient_id, medication_factors)
+    return medication_factors
+
+
+def _insulin_log_entry(log, medication_factors):
+    """Format a standalone insulin medication log"""
+    insulin_log = {
+        'id': str(log['_id']),
+        'medication': log['medication'],
+        'dose': log['dose'],
+        'taken_at': log['taken_at'],
+        'scheduled_time': log.get('scheduled_time', log['taken_at']),
+        'notes': log.get('notes', ''),
+        'status': log.get('status', 'completed'),
+        'meal_type': log.get('meal_type', 'insulin_only'),
+        'is_insulin': True,
+        'blood_sugar': log.get('blood_sugar')
+    }
+
+    # Add insulin parameters
+    pharmacokinetics = medication_factors.get(log['medication'])
+    if pharmacokinetics:
+        insulin_log['pharmacokinetics'] = pharmacokinetics
+
+    return insulin_log
+
+
+def _meal_insulin_entries(meals):
+    """Format the insulin recorded with meals, skipping duplicates"""
+    seen_meal_ids = set()
+    for meal in meals:
+        # Skip if there's no insulin data in this meal record
+        if not meal.get('intended_insulin'):
+            continue
+
+        # Check if this is already in the logs to avoid duplication
+        meal_id = str(meal['_id'])
+        if meal_id in seen_meal_ids:
+            continue
+        seen_meal_ids.add(meal_id)
+
+        insulin_log = {
+            'id': f"meal-{meal_id}",
+            'meal_id': meal_id,
+            'medication': meal.get('intended_insulin_type', 'rapid_acting'),
+            'dose': meal['intended_insulin'],
+            'taken_at': meal['timestamp'],
+            'scheduled_time': meal['timestamp'],
+            'notes': meal.get('notes', ''),
+            'status': 'completed',
+            'meal_type': meal.get('meal_type', 'other'),
+            'is_insulin': True,
+            'blood_sugar': meal.get('blood_sugar'),
+            'suggested_dose': meal.get('suggested_insulin')
+        }
+
+        # Add food items summary if available
+        food_items = meal.get('food_items')
+        if food_items:
+            food_names = itertools.islice((item.get('name', 'Unknown food') for item in food_items), 3)
+            insulin_log['notes'] += f" Meal: {', '.join(food_names)}"
+            if len(food_items) > 3:
+                insulin_log['notes'] += f" and {len(food_items) - 3} more"
+
+        yield insulin_log
+
+
+def _page_key(entry):
+    """
+    Position of an insulin-data entry in the newest-first order: (taken_at,
+    source, _id hex). Unique per entry, so it also serves as the page cursor.
+    """
+    if 'meal_id' in entry:
+        return entry['taken_at'], _SOURCE_MEAL, entry['meal_id']
+    return entry['taken_at'], _SOURCE_LOG, entry['id']
+
+
+def _parse_page_cursor(cursor):
+    """Parse a meta.next_cursor value back into (taken_at, source, ObjectId)"""
+    taken_at, source, entry_id = cursor.split('|')
+    if source not in (_SOURCE_LOG, _SOURCE_MEAL) or not ObjectId.is_valid(entry_id):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return datetime.fromisoformat(taken_at.rstrip('Z')), source, ObjectId(entry_id)
+
+
+def _after_cursor(time_field, source, cursor):
+    """$match clause selecting one collection's entries that sort after the cursor"""
+    taken_at, cursor_source, cursor_id = cursor
+    after = [{time_field: {'$lt': taken_at}}]
+    if source == cursor_source:
+        after.append({time_field: taken_at, '_id': {'$lt': cursor_id}})
+    elif source < cursor_source:
+        # At the cursor's time this whole source comes after the cursor's one
+        after.append({time_field: taken_at})
+    return {'$or': after}
+
+
+def _stream_insulin_logs(logs, meta, limit=None):
+    """
+    Yield the insulin-data JSON body one log at a time; meta comes last for
+    the count and, when a full page was returned, the cursor of the next page.
+    """
+    yield b'{"insulin_logs":['
+    count = 0
+    log = None
+    try:
+        for log in logs:
+            yield dumps(log) if count == 0 else b',' + dumps(log)
+            count += 1
+    except Exception as e:
+        logger.error(f"Error streaming insulin data: {str(e)}")
+        raise
+
+    next_cursor = '|'.join(_page_key(log)) if limit and count == limit else None
+    yield b'],"meta":' + dumps(dict(meta, count=count, next_cursor=next_cursor)) + b'}'
+
 
 @insulin_routes.route('/api/insulin-data', methods=['GET'])
 @token_required
@@ -19,31 +321,53 @@ def get_insulin_data(current_user):
     Endpoint to retrieve insulin data for visualization.
 
     Query Parameters:
-    - days: Number of days to look back (default 30)
+    - days: Number of days to look back (default 30, at most MAX_INSULIN_DAYS)
     - end_date: End date for the query (default today)
     - patient_id: If doctor is viewing patient data (optional)
+    - limit: Page size (optional, 1 to MAX_INSULIN_PAGE_SIZE)
+    - before: meta.next_cursor of the previous page (optional)
     """
     try:
         # Parse query parameters
-        days = int(request.args.get('days', 30))
-        end_date_str = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+        days = min(int(request.args.get('days', 30)), MAX_INSULIN_DAYS)
+        limit = request.args.get('limit')
+        if limit:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                return jsonify({'error': 'limit must be a positive integer'}), 400
+            limit = min(limit, MAX_INSULIN_PAGE_SIZE)
+        else:
+            limit = None
+        before_str = request.args.get('before')
+        end_date_str = request.args.get('end_date', datetime.now(timezone.utc).strftime('%Y-%m-%d'))
         patient_id = request.args.get('patient_id')
 
         # Parse end_date to datetime object
         try:
-            if 'T' in end_date_str:  # Check if time component is included
-                end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-            else:
-                end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-                # Set to end of day
+            # A trailing Z means UTC, which is how naive datetimes are stored
+            end_date = datetime.fromisoformat(end_date_str.rstrip('Z'))
+            if len(end_date_str) == 10:  # Date only: set to end of day
                 end_date = end_date.replace(hour=23, minute=59, second=59)
         except ValueError:
             # Fallback to current date if parsing fails
             logger.warning(f"Invalid date format: {end_date_str}, using current date")
-            end_date = datetime.now()
+            end_date = datetime.now(timezone.utc).replace(tzinfo=None)
 
         # Calculate start date
         start_date = end_date - timedelta(days=days)
+        time_range = {'$gte': start_date, '$lte': end_date}
+
+        # Continue after the last entry of the previous page
+        cursor = None
+        if before_str:
+            try:
+                cursor = _parse_page_cursor(before_str)
+            except ValueError:
+                return jsonify({'error': 'Invalid before cursor format'}), 400
+        page_stages = [{'$limit': limit}] if limit else []
 
         # Determine which user's data to query
         target_user_id = patient_id if patient_id else str(current_user['_id'])
@@ -52,108 +376,62 @@ def get_insulin_data(current_user):
         if patient_id and current_user.get('role') != 'doctor':
             return jsonify({'error': 'Unauthorized access to patient data'}), 403
 
-        # Query medication logs for insulin
-        insulin_logs = list(mongo.db.medication_logs.find({
-            'patient_id': target_user_id,
-            'is_insulin': True,
-            'taken_at': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }).sort('taken_at', pymongo.DESCENDING))
-
-        # Query medication events from meals collection for comprehensive insulin data
-        meal_insulin = list(mongo.db.meals.find({
-            'patient_id': target_user_id,
-            'intended_insulin': {'$exists': True, '$ne': None},
-            'timestamp': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }).sort('timestamp', pymongo.DESCENDING))
-
-        # Combine and format insulin data
-        combined_logs = []
-
-        # Process standalone insulin logs
-        for log in insulin_logs:
-            insulin_log = {
-                'id': str(log['_id']),
-                'medication': log['medication'],
-                'dose': log['dose'],
-                'taken_at': log['taken_at'].isoformat() + 'Z' if isinstance(log['taken_at'], datetime) else log[
-                    'taken_at'],
-                'scheduled_time': log.get('scheduled_time', log['taken_at']).isoformat() + 'Z' if isinstance(
-                    log.get('scheduled_time', log['taken_at']), datetime) else log.get('scheduled_time',
-                                                                                       log['taken_at']),
-                'notes': log.get('notes', ''),
-                'status': log.get('status', 'completed'),
-                'meal_type': log.get('meal_type', 'insulin_only'),
-                'is_insulin': True,
-                'blood_sugar': log.get('blood_sugar')
-            }
-
-            # Add insulin parameters
-            try:
-                # Get patient constants for insulin parameters
-                patient_constants = mongo.db.patient_constants.find_one({'patient_id': target_user_id})
-                if patient_constants and 'medication_factors' in patient_constants:
-                    insulin_type = log['medication']
-                    if insulin_type in patient_constants['medication_factors']:
-                        insulin_log['pharmacokinetics'] = patient_constants['medication_factors'][insulin_type]
-            except Exception as e:
-                logger.warning(f"Error fetching insulin parameters: {str(e)}")
-
-            combined_logs.append(insulin_log)
-
-        # Process meal-related insulin
-        for meal in meal_insulin:
-            # Skip if there's no insulin data in this meal record
-            if not meal.get('intended_insulin'):
-                continue
-
-            # Check if this is already in the logs to avoid duplication
-            meal_id = str(meal['_id'])
-            if any(log.get('meal_id') == meal_id for log in combined_logs):
-                continue
+        # Insulin parameters are per patient, so fetch them once for all logs
+        medication_factors = get_medication_factors(target_user_id)
 
-            insulin_log = {
-                'id': f"meal-{meal_id}",
-                'meal_id': meal_id,
-                'medication': meal.get('intended_insulin_type', 'rapid_acting'),
-                'dose': meal['intended_insulin'],
-                'taken_at': meal['timestamp'].isoformat() + 'Z' if isinstance(meal['timestamp'], datetime) else meal[
-                    'timestamp'],
-                'scheduled_time': meal['timestamp'].isoformat() + 'Z' if isinstance(meal['timestamp'], datetime) else
-                meal['timestamp'],
-                'notes': meal.get('notes', ''),
-                'status': 'completed',
-                'meal_type': meal.get('meal_type', 'other'),
+        # Query medication logs for insulin; times arrive already formatted.
+        # aggregate() runs the first batch immediately, so this overlaps with
+        # the meals query below.
+        insulin_logs_future = _query_executor.submit(mongo.db.medication_logs.aggregate, [
+            {'$match': {
+                'patient_id': target_user_id,
                 'is_insulin': True,
-                'blood_sugar': meal.get('blood_sugar'),
-                'suggested_dose': meal.get('suggested_insulin')
-            }
+                'taken_at': time_range,
+                **(_after_cursor('taken_at', _SOURCE_LOG, cursor) if cursor else {})
+            }},
+            {'$sort': {'taken_at': pymongo.DESCENDING, '_id': pymongo.DESCENDING}},
+            *page_stages,
+            _INSULIN_LOG_PROJECTION
+        ])
 
-            # Add food items summary if available
-            if meal.get('food_items') and len(meal['food_items']) > 0:
-                food_names = [item.get('name', 'Unknown food') for item in meal['food_items']]
-                insulin_log['notes'] += f" Meal: {', '.join(food_names[:3])}"
-                if len(food_names) > 3:
-                    insulin_log['notes'] += f" and {len(food_names) - 3} more"
-
-            combined_logs.append(insulin_log)
-
-        # Sort again by taken_at timestamp to ensure chronological order
-        combined_logs.sort(key=lambda x: x['taken_at'], reverse=True)
-
-        return jsonify({
-            'insulin_logs': combined_logs,
-            'meta': {
-                'start_date': start_date.isoformat(),
-                'end_date': end_date.isoformat(),
-                'count': len(combined_logs)
-            }
-        })
+        # Query medication events from meals collection for comprehensive insulin data
+        meal_insulin = mongo.db.meals.aggregate([
+            {'$match': {
+                'patient_id': target_user_id,
+                # $exists selects the partial index; $nin drops the values the
+                # formatter skips, so each page stays full
+                'intended_insulin': {'$exists': True, '$nin': [None, 0, False, '']},
+                'timestamp': time_range,
+                **(_after_cursor('timestamp', _SOURCE_MEAL, cursor) if cursor else {})
+            }},
+            {'$sort': {'timestamp': pymongo.DESCENDING, '_id': pymongo.DESCENDING}},
+            *page_stages,
+            _MEAL_INSULIN_PROJECTION
+        ])
+
+        insulin_logs = insulin_logs_future.result()
+
+        # Both cursors are already newest first, so merge them in order
+        # instead of re-sorting the combined list
+        combined_logs = heapq.merge(
+            (_insulin_log_entry(log, medication_factors) for log in insulin_logs),
+            _meal_insulin_entries(meal_insulin),
+            key=_page_key,
+            reverse=True
+        )
+        if limit:
+            combined_logs = itertools.islice(combined_logs, limit)
+
+        # Start iterating before streaming so database errors still get a 500
+        first_log = next(combined_logs, None)
+        if first_log is not None:
+            combined_logs = itertools.chain((first_log,), combined_logs)
+
+        meta = {'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()}
+        return Response(
+            _stream_insulin_logs(combined_logs, meta, limit),
+            mimetype='application/json'
+        )
 
     except Exception as e:
         logger.error(f"Error retrieving insulin data: {str(e)}")
@@ -166,8 +444,8 @@ def get_insulin_analytics(current_user):
     """Get insulin analytics including timing patterns and effectiveness"""
     try:
         # Get query parameters
-        days = int(request.args.get('days', 30))
-        end_date = datetime.utcnow()
+        days = min(int(request.args.get('days', 30)), MAX_INSULIN_DAYS)
+        end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=days)
 
         # Check if we're getting data for a specific patient (doctor access)
@@ -177,9 +455,8 @@ def get_insulin_analytics(current_user):
 
         user_id = patient_id if patient_id else str(current_user['_id'])
 
-        # Get insulin logs with blood sugar readings
+        # Match insulin logs in date range, then join and analyze them
         pipeline = [
-            # Match insulin logs in date range
             {
                 '$match': {
                     'patient_id': user_id,
@@ -187,81 +464,11 @@ def get_insulin_analytics(current_user):
                     'taken_at': {'$gte': start_date, '$lte': end_date}
                 }
             },
-            # Group by medication type
-            {
-                '$group': {
-                    '_id': '$medication',
-                    'total_doses': {'$sum': 1},
-                    'avg_dose': {'$avg': '$dose'},
-                    'doses': {'$push': {
-                        'dose': '$dose',
-                        'taken_at': '$taken_at',
-                        'blood_sugar': '$blood_sugar',
-                        'meal_type': '$meal_type',
-                        'meal_id': '$meal_id'
-                    }}
-                }
-            }
+            *_ANALYTICS_STAGES
         ]
 
         insulin_analytics = list(mongo.db.medication_logs.aggregate(pipeline))
 
-        # Enhance with meal timing analysis
-        for insulin_type in insulin_analytics:
-            medication = insulin_type['_id']
-            doses = insulin_type['doses']
-
-            meal_timing_analysis = {'before_meal': 0, 'with_meal': 0, 'after_meal': 0, 'unknown': 0}
-            meal_types = {'breakfast': 0, 'lunch': 0, 'dinner': 0, 'snack': 0, 'other': 0}
-            blood_sugar_changes = []
-
-            for dose in doses:
-                # Count meal types
-                meal_type = dose.get('meal_type')
-                if meal_type in meal_types:
-                    meal_types[meal_type] += 1
-                else:
-                    meal_types['other'] += 1
-
-                # If the dose has a meal ID, analyze timing
-                if dose.get('meal_id'):
-                    try:
-                        meal = mongo.db.meals.find_one({'_id': ObjectId(dose['meal_id'])})
-                        if meal:
-                            # Determine timing: before, with, or after meal
-                            meal_time = meal.get('timestamp')
-                            dose_time = dose['taken_at']
-
-                            if not meal_time or not dose_time:
-                                meal_timing_analysis['unknown'] += 1
-                            else:
-                                diff_minutes = (dose_time - meal_time).total_seconds() / 60
-
-                                if diff_minutes < -15:  # More than 15 min before meal
-                                    meal_timing_analysis['before_meal'] += 1
-                                elif diff_minutes > 15:  # More than 15 min after meal
-                                    meal_timing_analysis['after_meal'] += 1
-                                else:  # Within 15 min of meal
-                                    meal_timing_analysis['with_meal'] += 1
-
-                            # If there's a blood sugar reading in the meal, track the change
-                            if meal.get('bloodSugar') and dose.get('blood_sugar'):
-                                blood_sugar_changes.append({
-                                    'before': dose['blood_sugar'],
-                                    'after': meal['bloodSugar'],
-                                    'change': meal['bloodSugar'] - dose['blood_sugar'],
-                                    'meal_type': meal.get('mealType')
-                                })
-                    except Exception as e:
-                        logger.error(f"Error analyzing meal timing: {str(e)}")
-                else:
-                    meal_timing_analysis['unknown'] += 1
-
-            # Add analysis to the response
-            insulin_type['meal_timing_analysis'] = meal_timing_analysis
-            insulin_type['meal_types'] = meal_types
-            insulin_type['blood_sugar_changes'] = blood_sugar_changes
-
         return jsonify({
             'insulin_analytics': insulin_analytics,
             'date_range': {
@@ -291,8 +498,6 @@ def calculate_insulin_activity(hours_since_dose, params):
     Returns:
         float: Activity percentage (0-100)
     """
-    import math
-
     # Extract parameters with defaults
     onset_hours = params.get('onset_hours', 0.5)
     peak_hours = params.get('peak_hours', 2.0)
@@ -361,13 +566,6 @@ def calculate_stacked_insulin_effect(patient_id, target_time=None):
     Returns:
         dict: Information about active insulin
     """
-    from config import mongo
-    from datetime import datetime, timedelta
-    import logging
-    import math  # Add math import for exponential functions
-
-    logger = logging.getLogger(__name__)
-
     if target_time is None:
         target_time = datetime.utcnow()
 
@@ -378,26 +576,31 @@ def calculate_stacked_insulin_effect(patient_id, target_time=None):
 
     logger.debug(f"Calculating insulin effect at target time: {target_time.isoformat()}")
 
-    # Find all active insulin doses (not yet at effect_end_time)
-    active_insulin = list(mongo.db.medication_logs.find({
+    # Find all active insulin doses (not yet at effect_end_time), fetching only
+    # the fields the activity calculation and contributions use
+    active_insulin = mongo.db.medication_logs.find({
         'patient_id': patient_id,
         'is_insulin': True,
         'effect_end_time': {'$gte': target_time}
-    }))
-
-    logger.debug(f"Found {len(active_insulin)} active insulin doses")
+    }, {'dose': 1, 'medication': 1, 'taken_at': 1, 'effect_profile': 1})
 
+    active_doses = 0
     total_active_insulin = 0
     insulin_contributions = []
+    # Per-dose debug messages format datetimes, so only build them when logged
+    debug = logger.isEnabledFor(logging.DEBUG)
 
     for dose in active_insulin:
+        active_doses += 1
+
         # Get the effect profile for this dose
         profile = dose.get('effect_profile', {})
 
         # Calculate time since dose in hours, ensuring consistent timezone handling
         taken_at = dose.get('taken_at')
         if not taken_at:
-            logger.debug(f"Skipping dose {dose.get('_id')} - missing taken_at time")
+            if debug:
+                logger.debug(f"Skipping dose {dose.get('_id')} - missing taken_at time")
             continue
 
         # Make sure taken_at is a datetime object (not a string)
@@ -409,12 +612,11 @@ def calculate_stacked_insulin_effect(patient_id, target_time=None):
                 logger.warning(f"Could not parse taken_at time for dose {dose.get('_id')}: {taken_at}")
                 continue
 
-        # Debug log the time values
-        logger.debug(f"Dose {dose.get('_id')}: taken_at={taken_at.isoformat()}, target_time={target_time.isoformat()}")
-
         # Calculate hours since dose
         hours_since_dose = (target_time - taken_at).total_seconds() / 3600
-        logger.debug(f"Hours since dose: {hours_since_dose:.2f}")
+        if debug:
+            logger.debug(f"Dose {dose.get('_id')}: taken_at={taken_at.isoformat()}, "
+                         f"target_time={target_time.isoformat()}, hours since dose: {hours_since_dose:.2f}")
 
         # Calculate current activity percentage using our improved function
         activity_percent = calculate_insulin_activity(hours_since_dose, profile)
@@ -427,7 +629,7 @@ def calculate_stacked_insulin_effect(patient_id, target_time=None):
             'dose_id': str(dose.get('_id')),
             'medication': dose.get('medication'),
             'initial_dose': initial_dose,
-            'taken_at': taken_at.isoformat() if isinstance(taken_at, datetime) else taken_at,
+            'taken_at': taken_at.isoformat(),
             'hours_since_dose': round(hours_since_dose, 2),
             'activity_percent': round(activity_percent, 1),
             'active_units': round(active_units, 2)
@@ -435,11 +637,13 @@ def calculate_stacked_insulin_effect(patient_id, target_time=None):
 
         total_active_insulin += active_units
 
+    logger.debug(f"Found {active_doses} active insulin doses")
+
     return {
         'total_active_insulin': round(total_active_insulin, 2),
         'calculation_time': target_time.isoformat(),
         'calculation_timezone': 'UTC',  # Explicitly state the timezone used
-        'active_doses': len(active_insulin),
+        'active_doses': active_doses,
         'insulin_contributions': insulin_contributions
     }
 
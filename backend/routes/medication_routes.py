@@ -17,20 +17,6 @@ def validate_time_format(time_str):
     except ValueError:
         return False
 
-def format_schedule(schedule):
-    """Helper function to format schedule for JSON response"""
-    return {
-        'id': str(schedule['_id']),
-        'medication': schedule['medication'],
-        'startDate': schedule['startDate'].isoformat(),
-        'endDate': schedule['endDate'].isoformat(),
-        'dailyTimes': schedule['dailyTimes'],
-        'created_at': schedule['created_at'].isoformat(),
-        'updated_at': schedule.get('updated_at', '').isoformat() if schedule.get('updated_at') else None
-    }
-
-
-
 @medication_routes.route('/api/medication-schedule/<patient_id>/<medication>', methods=['GET'])
 @token_required
 @api_error_handler
@@ -181,6 +167,7 @@ def create_initial_medication_logs(patient_id, medication, schedule):
         current_date = datetime.utcnow().date()
         current_datetime = datetime.utcnow()
 
+        medication_logs = []
         for daily_time in schedule['dailyTimes']:
             try:
                 # Parse the time string
@@ -196,8 +183,7 @@ def create_initial_medication_logs(patient_id, medication, schedule):
                 if next_dose_datetime < current_datetime:
                     next_dose_datetime += timedelta(days=1)
 
-                # Create the medication log
-                mongo.db.medication_logs.insert_one({
+                medication_logs.append({
                     'patient_id': patient_id,
                     'medication': medication,
                     'scheduled_time': next_dose_datetime,
@@ -210,6 +196,10 @@ def create_initial_medication_logs(patient_id, medication, schedule):
                 logger.error(f"Error processing time {daily_time}: {str(e)}")
                 continue
 
+        # Create all the medication logs in a single unordered batch
+        if medication_logs:
+            mongo.db.medication_logs.insert_many(medication_logs, ordered=False)
+
     except Exception as e:
         logger.error(f"Error creating initial medication logs: {str(e)}")
         raise
@@ -257,20 +247,19 @@ def delete_medication_schedule(current_user, patient_id, schedule_id):
         return jsonify({'message': 'Unauthorized access'}), 403
 
     try:
-        # Find the schedule first
-        schedule = mongo.db.medication_schedules.find_one({
+        schedule_filter = {
             '_id': ObjectId(schedule_id),
             'patient_id': patient_id
-        })
+        }
+
+        # Find the schedule first
+        schedule = mongo.db.medication_schedules.find_one(schedule_filter)
 
         if not schedule:
             return jsonify({'message': 'Schedule not found'}), 404
 
         # Delete the schedule
-        mongo.db.medication_schedules.delete_one({
-            '_id': ObjectId(schedule_id),
-            'patient_id': patient_id
-        })
+        mongo.db.medication_schedules.delete_one(schedule_filter)
 
         # Delete associated future logs
         mongo.db.medication_logs.delete_many({
@@ -361,18 +350,6 @@ def log_medication_dose(current_user, patient_id):
         return jsonify({"error": str(e)}), 500
 
 
-from flask import Blueprint, request, jsonify
-from bson.objectid import ObjectId
-from datetime import datetime
-from utils.auth import token_required
-from utils.error_handler import api_error_handler
-from config import mongo
-import logging
-
-logger = logging.getLogger(__name__)
-medication_routes = Blueprint('medication_routes', __name__)
-
-
 @medication_routes.route('/api/medication-logs/recent', methods=['GET'])
 @token_required
 @api_error_handler
@@ -1,9 +1,9 @@
 from flask import Blueprint, jsonify, request
 from datetime import datetime
-from bson.objectid import ObjectId
 from utils.auth import token_required
 from utils.error_handler import api_error_handler
 from config import mongo
+from constants import Constants
 import logging
 from datetime import datetime
 
@@ -25,15 +25,8 @@ def get_constants(current_user):
         user_id = str(current_user['_id'])
         logger.debug(f"Fetching constants for user: {user_id}")
 
-        # Get user from database
-        try:
-            user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                logger.error(f"User not found: {user_id}")
-                return jsonify({'error': 'User not found'}), 404
-        except Exception as e:
-            logger.error(f"Database error finding user: {str(e)}")
-            return jsonify({'error': 'Database error'}), 500
+        # token_required already loaded the user document
+        user = current_user
 
         try:
             # Get active medication schedules
@@ -57,7 +50,6 @@ def get_constants(current_user):
                     continue
 
             # Get default values from your constants
-            from constants import Constants
             default_constants = Constants.DEFAULT_PATIENT_CONSTANTS
 
             # Build response with defaults for missing values
@@ -1,7 +1,12 @@
-from utils.auth import token_required
+from utils.auth import token_required, doctor_required
 from utils.error_handler import api_error_handler
+from utils.cache import cache
+from utils.json_response import json_response
 
 __all__ = [
     'token_required',
-    'api_error_handler'
+    'doctor_required',
+    'api_error_handler',
+    'cache',
+    'json_response'
 ]
\ No newline at end of file
@@ -45,4 +45,17 @@ def token_required(f):
 
         return f(current_user, *args, **kwargs)
 
-    return decorated
\ No newline at end of file
+    return decorated
+
+
+def doctor_required(f):
+    """Reject non-doctor users; must be applied below @token_required"""
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if current_user.get('user_type') != 'doctor':
+            current_app.logger.warning(f"Unauthorized access attempt by user: {current_user.get('_id')}")
+            return jsonify({'message': 'Unauthorized access'}), 403
+
+        return f(current_user, *args, **kwargs)
+
+    return decorated
@@ -0,0 +1,112 @@
+# utils/cache.py
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # Redis is optional; without it responses are cached in-process
+    redis = None
+
+
+class TTLCache:
+    """
+    Small in-process cache whose entries expire after a number of seconds.
+    When full, expired entries are dropped first, then everything.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = {}
+        # Shared by request threads and the import workers
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.maxsize:
+                    self._entries.clear()
+            self._entries[key] = (now + (self.ttl if ttl is None else ttl), value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class ResponseCache:
+    """
+    TTL cache for already-serialized response bodies.
+
+    Uses Redis when REDIS_URL is configured and the redis package is installed,
+    otherwise falls back to a per-process dictionary.
+    """
+
+    MAX_LOCAL_ENTRIES = 1024
+
+    def __init__(self):
+        self._client = None
+        self._local = TTLCache(self.MAX_LOCAL_ENTRIES)
+
+    def init_app(self, app):
+        url = app.config.get('REDIS_URL')
+        if url and redis is not None:
+            self._client = redis.Redis.from_url(url)
+            logger.info("Response cache using Redis")
+        elif url:
+            logger.warning("REDIS_URL is set but redis is not installed, using in-process cache")
+
+    def get(self, key):
+        if self._client is not None:
+            try:
+                return self._client.get(key)
+            except Exception as e:
+                logger.warning(f"Cache get failed for {key}: {str(e)}")
+                return None
+
+        return self._local.get(key)
+
+    def set(self, key, value, expire=300):
+        if self._client is not None:
+            try:
+                self._client.set(key, value, ex=expire)
+            except Exception as e:
+                logger.warning(f"Cache set failed for {key}: {str(e)}")
+            return
+
+        self._local.set(key, value, expire)
+
+    def delete(self, key):
+        if self._client is not None:
+            try:
+                self._client.delete(key)
+            except Exception as e:
+                logger.warning(f"Cache delete failed for {key}: {str(e)}")
+            return
+
+        self._local.delete(key)
+
+
+cache = ResponseCache()
+
+
+def patient_constants_cache_key(patient_id, version):
+    """
+    Cache key of the doctor view of a patient's constants at a constants_version.
+    Writes bump the version, so an entry can never be served for newer constants.
+    """
+    return f"pt_constants:{patient_id}:{version}"
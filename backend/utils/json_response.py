@@ -0,0 +1,51 @@
+# utils/json_response.py
+import json
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2 has no pluggable JSON provider
+    DefaultJSONProvider = None
+
+
+def dumps(obj):
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str).encode('utf-8')
+
+
+def json_response(obj):
+    """Build a JSON response like jsonify, but encoded with dumps()"""
+    return current_app.response_class(dumps(obj), mimetype='application/json')
+
+
+if orjson is not None and DefaultJSONProvider is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """
+        Flask JSON provider that encodes with orjson.
+
+        Output matches the default provider: dates still go through its
+        default() hook, and anything orjson rejects is re-encoded with json.
+        """
+
+        def dumps(self, obj, **kwargs):
+            # orjson output is always compact; leave other options (e.g. indent
+            # for debug output) to the stdlib encoder
+            if kwargs.keys() - {'separators'}:
+                return super().dumps(obj, **kwargs)
+
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            except TypeError:
+                return super().dumps(obj)
+else:
+    OrjsonProvider = None